@@ -0,0 +1,68 @@
+# app/archive.py
+"""
+Фоновый перенос завершённых задач в архив.
+
+mark_done только меняет статус, и без архива tasks со временем состоит
+в основном из закрытых задач. Раз в every секунд переносим задачи,
+закрытые больше age_days назад, в tasks_archive (см. db.archive_done_tasks).
+Пачками по batch: каждая пачка — отдельная короткая транзакция в потоке БД,
+и запросы хэндлеров успевают пройти между ними.
+"""
+import asyncio
+import logging
+import time
+
+from app import db_async
+
+logger = logging.getLogger(__name__)
+
+
+class TaskArchiver:
+    """
+    age_days — через сколько дней после закрытия задача уходит в архив,
+    every — как часто проверяем (секунды),
+    batch — сколько задач переносим одной транзакцией.
+    """
+
+    def __init__(self, age_days: float = 30, every: float = 3600, batch: int = 500):
+        self.age_days = age_days
+        self.every = every
+        self.batch = batch
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def archive(self) -> int:
+        """
+        Один проход: переносим пачками, пока есть что переносить.
+        """
+        closed_before = int(time.time() - self.age_days * 86400)
+        total = 0
+        while True:
+            moved = await db_async.archive_done_tasks(closed_before, self.batch)
+            total += moved
+            if moved < self.batch:
+                return total
+
+    async def _run(self):
+        while True:
+            try:
+                moved = await self.archive()
+                if moved:
+                    logger.info("Архив: перенесено завершённых задач: %s", moved)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Архив: не удалось перенести завершённые задачи")
+            await asyncio.sleep(self.every)
@@ -1,7 +1,6 @@
 # app/bot_handlers.py
 import logging
-from datetime import datetime, timedelta, time
-from zoneinfo import ZoneInfo
+from datetime import datetime
 
 from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
@@ -12,24 +11,41 @@ from aiogram.types import (
     InlineKeyboardButton,
     ReplyKeyboardRemove,
 )
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-
-from app.db import (
+from aiogram.utils.exceptions import MessageNotModified
+
+from app.outbound import OutboundQueue
+from app.parser import parse_task_line
+from app.reminders import (
+    ReminderEngine,
+    cancel_task_reminders,
+    schedule_task_reminders,
+)
+from app.db import MOSCOW_TZ, chat_version
+from app.db_profile import format_report
+from app.read_model import ACTIVE
+from app.render_cache import PageCache
+from app.users import UserCache
+from app.db_async import (
     add_task,
-    get_tasks,
+    get_done_tasks_page,
     mark_done,
     add_completion,
     get_task,
-    get_task_completions,
     save_last_action,
-    get_last_action,
-    clear_last_action,
+    pop_last_action,
     restore_task_status,
     delete_completion,
+    set_profiling,
+    profile_report,
 )
 
 logger = logging.getLogger(__name__)
-MOSCOW_TZ = ZoneInfo("Europe/Moscow")
+
+# Сколько задач показываем на одной странице «📋 Мои задачи» и «🏁 Завершённые»
+TASKS_PAGE_SIZE = 10
+HISTORY_PAGE_SIZE = 10
+# Сколько отрисованных страниц списка задач держим в памяти
+PAGE_CACHE_SIZE = 2000
 
 
 class TaskFSM(StatesGroup):
@@ -44,17 +60,24 @@ class TaskFSM(StatesGroup):
 def main_menu() -> ReplyKeyboardMarkup:
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
     kb.add("➕ Новая задача", "📋 Мои задачи")
-    kb.add("↩️ Отменить последнее")
+    kb.add("↩️ Отменить последнее", "🏁 Завершённые")
     return kb
 
 
-def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
+def register_handlers(
+    dp: Dispatcher,
+    reminders: ReminderEngine,
+    user_cache: UserCache,
+    outbound: OutboundQueue,
+    owner_id: int = 0,
+):
     # ────────────────────────────────
     # /start
     # ────────────────────────────────
     @dp.message_handler(commands=["start"])
     async def start_cmd(m: types.Message):
-        await m.answer(
+        await outbound.answer(
+            m,
             f"🙌 Привет, {m.from_user.first_name}!\n\n"
             "Я твой бот-дедлайнер: помогу не забыть задачи, "
             "даже когда ты забываешь, что выспаться тоже задача 😎\n\n"
@@ -70,7 +93,8 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
     # ────────────────────────────────
     @dp.message_handler(commands=["hidekb"])
     async def hide_kb(m: types.Message):
-        await m.answer(
+        await outbound.answer(
+            m,
             "Скрыла клавиатуру бота 👌\n"
             "Чтобы вернуть меню, напиши /showkb",
             reply_markup=ReplyKeyboardRemove(),
@@ -81,7 +105,8 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
     # ────────────────────────────────
     @dp.message_handler(commands=["showkb"])
     async def show_kb(m: types.Message):
-        await m.answer(
+        await outbound.answer(
+            m,
             "Возвращаю меню бота 👇",
             reply_markup=main_menu(),
         )
@@ -91,7 +116,8 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
     # ────────────────────────────────
     @dp.message_handler(lambda m: m.text == "➕ Новая задача")
     async def new_task(m: types.Message, state: FSMContext):
-        await m.answer(
+        await outbound.answer(
+            m,
             "📝 Кидай задачу одной строкой:\n\n"
             "<b>Название задачи 28.10.2025 14:30</b>\n\n"
             "Без слэшей, без палок, только ты и твой дедлайн 😌",
@@ -108,44 +134,35 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
         # просто выходим из состояния, ничего не сохраняем
         if text == "↩️ Отменить последнее":
             await state.finish()
-            await m.answer(
+            await outbound.answer(
+                m,
                 "Окей, отменяю ввод новой задачи. Ничего не сохранила 🙂",
                 reply_markup=main_menu(),
             )
             return
 
-        if len(text) < 17:
-            await m.answer(
-                "❌ Нужен формат:\n"
-                "<b>Сделать отчёт 28.10.2025 14:30</b>",
+        parsed = parse_task_line(text)
+        if parsed is None:
+            await outbound.answer(
+                m,
+                "❌ Не смог прочитать дату и время.\n"
+                "Нужен формат: <b>Сделать отчёт 28.10.2025 14:30</b>\n"
+                "Можно и так: <b>28.10 14:30</b>, <b>завтра 10:00</b>",
                 parse_mode="HTML",
             )
             return
 
-        dt_str = text[-16:]  # "28.10.2025 14:30"
-        title_part = text[:-16].strip()
-
-        if not title_part:
-            await m.answer(
+        title, deadline = parsed
+        if not title:
+            await outbound.answer(
+                m,
                 "❌ Не вижу названия задачи перед датой.\n"
                 "Пример: <b>Сделать отчёт 28.10.2025 14:30</b>",
                 parse_mode="HTML",
             )
             return
 
-        try:
-            deadline = datetime.strptime(dt_str, "%d.%m.%Y %H:%M")
-        except ValueError:
-            await m.answer(
-                "❌ Не смог прочитать дату и время.\n"
-                "Нужен формат: <b>28.10.2025 14:30</b>",
-                parse_mode="HTML",
-            )
-            return
-
-        title = title_part
-
-        task_id = add_task(
+        task_id = await add_task(
             chat_id=m.chat.id,
             title=title,
             deadline=deadline,
@@ -153,7 +170,7 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
         )
 
         # логируем добавление задачи
-        save_last_action(
+        await save_last_action(
             chat_id=m.chat.id,
             user_id=m.from_user.id,
             action_type="add_task",
@@ -161,16 +178,15 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
             completion_id=None,
         )
 
-        schedule_task_jobs(
-            dp=dp,
+        await schedule_task_reminders(
+            reminders,
             task_id=task_id,
             chat_id=m.chat.id,
-            title=title,
             deadline=deadline,
-            scheduler=scheduler,
         )
 
-        await m.answer(
+        await outbound.answer(
+            m,
             f"✅ Задача «<b>{title}</b>» сохранена.\n"
             f"Дедлайн: <b>{deadline.strftime('%d.%m.%Y %H:%M')}</b>\n\n"
             "Если что, список задач — в кнопке <b>«📋 Мои задачи»</b>.",
@@ -182,49 +198,66 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
     # ────────────────────────────────
     # Кнопка «Мои задачи»
     # ────────────────────────────────
-    @dp.message_handler(lambda m: m.text == "📋 Мои задачи")
-    async def list_tasks(m: types.Message):
-        rows = get_tasks(m.chat.id)
+    page_cache = PageCache(PAGE_CACHE_SIZE)
+
+    async def render_tasks_page(chat_id: int, start: int, after=None, before=None):
+        """
+        Текст и клавиатура одной страницы списка задач.
+        start — порядковый номер первой задачи страницы (для подписей «1 ✅»).
+        Возвращает None, если активных задач нет.
+
+        Пока версия данных чата не поменялась, отдаём страницу из page_cache.
+        Версию читаем до запроса: если запись успеет пройти между ними,
+        страница сохранится под старой версией и просто перерисуется в следующий раз.
+        """
+        key = (chat_id, start, after, before)
+        version = chat_version(chat_id)
+        cached = page_cache.get(key, version)
+        if cached is not None:
+            return cached[1]
+
+        page = await _render_tasks_page(chat_id, start, after, before)
+        page_cache.put(key, version, page)
+        return page
+
+    async def _render_tasks_page(chat_id: int, start: int, after=None, before=None):
+        # активные задачи — из модели чтения в памяти, без БД
+        rows, has_more = ACTIVE.page(chat_id, TASKS_PAGE_SIZE, after=after, before=before)
+        if not rows and (after is not None or before is not None):
+            # страница опустела (задачи закрыли) — показываем первую
+            return await render_tasks_page(chat_id, 1)
         if not rows:
-            await m.answer(
-                "📭 Активных задач нет — можно официально прокрастинировать 🙌",
-                reply_markup=main_menu(),
-            )
-            return
+            return None
+
+        if before is not None:
+            has_prev, has_next = has_more, True
+            if not has_prev:
+                start = 1
+        else:
+            has_prev, has_next = after is not None, has_more
+
+        # имена всех отметившихся — из кэша, без запроса на каждого
+        names = await user_cache.resolve(
+            dp.bot, [user_id for r in rows for user_id in r.completers]
+        )
 
         text_lines = []
         kb = InlineKeyboardMarkup(row_width=2)
 
-        for idx, r in enumerate(rows, start=1):
-            dl = datetime.fromisoformat(r["deadline_ts"]).strftime("%d.%m.%Y %H:%M")
+        for idx, r in enumerate(rows, start=start):
+            dl = datetime.fromtimestamp(r.deadline_at, MOSCOW_TZ).strftime("%d.%m.%Y %H:%M")
 
             # --- кто уже отметил выполнение ---
-            completions = get_task_completions(r["id"])
-            if completions:
-                users_str = []
-                for c in completions:
-                    user_id = c["user_id"]
-                    try:
-                        tg_user = await dp.bot.get_chat(user_id)
-                        if tg_user.username:
-                            users_str.append(f"@{tg_user.username}")
-                        else:
-                            users_str.append(tg_user.full_name)
-                    except Exception as e:
-                        logger.warning(
-                            "Не смогли получить данные пользователя %s: %s",
-                            user_id,
-                            e,
-                        )
-                        users_str.append(f"ID:{user_id}")
-
-                done_line = "✅ Выполнили: " + ", ".join(users_str)
+            if r.completers:
+                done_line = "✅ Выполнили: " + ", ".join(
+                    names[user_id] for user_id in r.completers
+                )
             else:
                 done_line = "⏳ Пока никто не отметил выполнение"
 
             # --- блок текста по задаче с номером ---
             block = (
-                f"{idx}. <b>{r['title']}</b>\n"
+                f"{idx}. <b>{r.title}</b>\n"
                 f"   🕒 до <b>{dl}</b>\n"
                 f"   {done_line}"
             )
@@ -234,20 +267,181 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
             kb.add(
                 InlineKeyboardButton(
                     text=f"{idx} ✅",
-                    callback_data=f"done:{r['id']}",
+                    callback_data=f"done:{r.id}",
                 ),
                 InlineKeyboardButton(
                     text=f"{idx} 🔒",
-                    callback_data=f"close:{r['id']}",
+                    callback_data=f"close:{r.id}",
                 ),
             )
 
-        await m.answer(
-            "🗓 <b>Активные задачи:</b>\n\n" + "\n\n".join(text_lines),
-            reply_markup=kb,
-            parse_mode="HTML",
+        # навигация: курсор — первая/последняя задача текущей страницы
+        nav = []
+        if has_prev:
+            first = rows[0]
+            nav.append(
+                InlineKeyboardButton(
+                    text="◀️ Назад",
+                    callback_data=f"page:prev:{max(start - TASKS_PAGE_SIZE, 1)}:"
+                    f"{first.deadline_at}:{first.id}",
+                )
+            )
+        if has_next:
+            last = rows[-1]
+            nav.append(
+                InlineKeyboardButton(
+                    text="Дальше ▶️",
+                    callback_data=f"page:next:{start + len(rows)}:"
+                    f"{last.deadline_at}:{last.id}",
+                )
+            )
+        if nav:
+            kb.row(*nav)
+
+        text = "🗓 <b>Активные задачи:</b>\n\n" + "\n\n".join(text_lines)
+        return text, kb
+
+    @dp.message_handler(lambda m: m.text == "📋 Мои задачи")
+    async def list_tasks(m: types.Message):
+        page = await render_tasks_page(m.chat.id, 1)
+        if page is None:
+            await outbound.answer(
+                m,
+                "📭 Активных задач нет — можно официально прокрастинировать 🙌",
+                reply_markup=main_menu(),
+            )
+            return
+
+        text, kb = page
+        await outbound.answer(m, text, reply_markup=kb, parse_mode="HTML")
+
+    # ────────────────────────────────
+    # CALLBACK: листание списка задач
+    # ────────────────────────────────
+    @dp.callback_query_handler(lambda c: c.data and c.data.startswith("page:"))
+    async def list_tasks_page(callback_query: types.CallbackQuery):
+        try:
+            _, direction, start, deadline_at, task_id = callback_query.data.split(":")
+            cursor = (int(deadline_at), int(task_id))
+            start = int(start)
+        except ValueError:
+            await callback_query.answer()
+            return
+
+        chat_id = callback_query.message.chat.id
+        if direction == "next":
+            page = await render_tasks_page(chat_id, start, after=cursor)
+        else:
+            page = await render_tasks_page(chat_id, start, before=cursor)
+
+        if page is None:
+            await outbound.edit_text(
+                callback_query.message,
+                "📭 Активных задач нет — можно официально прокрастинировать 🙌",
+            )
+            await callback_query.answer()
+            return
+
+        text, kb = page
+        try:
+            await outbound.edit_text(
+                callback_query.message, text, reply_markup=kb, parse_mode="HTML"
+            )
+        except MessageNotModified:
+            pass
+        await callback_query.answer()
+
+    # ────────────────────────────────
+    # Кнопка «Завершённые» — история закрытых задач (в т.ч. из архива)
+    # ────────────────────────────────
+    async def render_history_page(chat_id: int, start: int, after=None):
+        """
+        Текст и клавиатура одной страницы завершённых задач, от недавних к старым.
+        Возвращает None, если завершённых задач нет.
+        """
+        rows, has_more = await get_done_tasks_page(chat_id, HISTORY_PAGE_SIZE, after=after)
+        if not rows and after is not None:
+            return await render_history_page(chat_id, 1)
+        if not rows:
+            return None
+
+        names = await user_cache.resolve(
+            dp.bot, [user_id for r in rows for user_id in r["completers"]]
         )
 
+        text_lines = []
+        for idx, r in enumerate(rows, start=start):
+            dl = datetime.fromisoformat(r["deadline_ts"]).strftime("%d.%m.%Y %H:%M")
+            closed = datetime.fromtimestamp(r["closed_at"], MOSCOW_TZ).strftime("%d.%m.%Y")
+            block = (
+                f"{idx}. <b>{r['title']}</b>\n"
+                f"   🕒 дедлайн {dl}, закрыта {closed}"
+            )
+            if r["completers"]:
+                block += "\n   ✅ " + ", ".join(names[user_id] for user_id in r["completers"])
+            text_lines.append(block)
+
+        # назад по keyset-курсору не листаем — только в начало
+        nav = []
+        if start > 1:
+            nav.append(InlineKeyboardButton(text="⏮ В начало", callback_data="hist:first"))
+        if has_more:
+            last = rows[-1]
+            nav.append(
+                InlineKeyboardButton(
+                    text="Дальше ▶️",
+                    callback_data=f"hist:next:{start + len(rows)}:{last['closed_at']}:{last['id']}",
+                )
+            )
+        kb = InlineKeyboardMarkup(row_width=2)
+        if nav:
+            kb.row(*nav)
+
+        text = "🏁 <b>Завершённые задачи:</b>\n\n" + "\n\n".join(text_lines)
+        return text, kb
+
+    @dp.message_handler(lambda m: m.text == "🏁 Завершённые")
+    async def list_done_tasks(m: types.Message):
+        page = await render_history_page(m.chat.id, 1)
+        if page is None:
+            await outbound.answer(
+                m,
+                "📭 Завершённых задач пока нет.",
+                reply_markup=main_menu(),
+            )
+            return
+
+        text, kb = page
+        await outbound.answer(m, text, reply_markup=kb, parse_mode="HTML")
+
+    @dp.callback_query_handler(lambda c: c.data and c.data.startswith("hist:"))
+    async def list_done_tasks_page(callback_query: types.CallbackQuery):
+        chat_id = callback_query.message.chat.id
+        parts = callback_query.data.split(":")
+        try:
+            if parts[1] == "next":
+                start, closed_at, task_id = int(parts[2]), int(parts[3]), int(parts[4])
+                page = await render_history_page(chat_id, start, after=(closed_at, task_id))
+            else:
+                page = await render_history_page(chat_id, 1)
+        except (IndexError, ValueError):
+            await callback_query.answer()
+            return
+
+        if page is None:
+            await outbound.edit_text(callback_query.message, "📭 Завершённых задач пока нет.")
+            await callback_query.answer()
+            return
+
+        text, kb = page
+        try:
+            await outbound.edit_text(
+                callback_query.message, text, reply_markup=kb, parse_mode="HTML"
+            )
+        except MessageNotModified:
+            pass
+        await callback_query.answer()
+
     # ────────────────────────────────
     # Глобальный однострочный ввод (в любом чате)
     # ────────────────────────────────
@@ -255,43 +449,37 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
         lambda m: (
             m.text
             and not m.text.startswith("/")
-            and m.text not in ("➕ Новая задача", "📋 Мои задачи", "↩️ Отменить последнее")
+            and m.text not in ("➕ Новая задача", "📋 Мои задачи", "↩️ Отменить последнее", "🏁 Завершённые")
         ),
         state=None,
     )
     async def inline_task_anywhere(m: types.Message):
         """
         Любое сообщение без / и без FSM-состояния пробуем
-        распарсить как: "Название задачи 28.10.2025 14:30".
+        распарсить как: "Название задачи 28.10.2025 14:30"
+        (или завтра 10:00; время — только через двоеточие, см. app/parser.py).
         Если не получилось — тихо игнорируем.
         """
         text = m.text.strip()
 
         # этот if теперь почти никогда не сработает из-за фильтра,
         # но оставляем его — он не мешает
-        if text in ("➕ Новая задача", "📋 Мои задачи", "↩️ Отменить последнее"):
-            return
-
-        if len(text) < 17:
-            logger.info("INLINE PARSE SKIP (too short): %r", text)
+        if text in ("➕ Новая задача", "📋 Мои задачи", "↩️ Отменить последнее", "🏁 Завершённые"):
             return
 
-        dt_str = text[-16:]
-        title_part = text[:-16].strip()
-
-        if not title_part:
-            logger.info("INLINE PARSE SKIP (no title): %r", text)
+        # обычная болтовня отсеивается здесь же, без регулярок и исключений;
+        # strict — задачу здесь никто явно не создаёт, так что только однозначные форматы
+        parsed = parse_task_line(text, strict=True)
+        if parsed is None:
+            logger.debug("INLINE PARSE SKIP (no datetime): %r", text)
             return
 
-        try:
-            deadline = datetime.strptime(dt_str, "%d.%m.%Y %H:%M")
-        except ValueError:
-            logger.info("INLINE PARSE SKIP (bad datetime): %r", text)
+        title, deadline = parsed
+        if not title:
+            logger.debug("INLINE PARSE SKIP (no title): %r", text)
             return
 
-        title = title_part
-
-        task_id = add_task(
+        task_id = await add_task(
             chat_id=m.chat.id,
             title=title,
             deadline=deadline,
@@ -299,7 +487,7 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
         )
 
         # логируем добавление задачи
-        save_last_action(
+        await save_last_action(
             chat_id=m.chat.id,
             user_id=m.from_user.id,
             action_type="add_task",
@@ -307,13 +495,11 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
             completion_id=None,
         )
 
-        schedule_task_jobs(
-            dp=dp,
+        await schedule_task_reminders(
+            reminders,
             task_id=task_id,
             chat_id=m.chat.id,
-            title=title,
             deadline=deadline,
-            scheduler=scheduler,
         )
 
         logger.info(
@@ -324,7 +510,8 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
             deadline.isoformat(),
         )
 
-        await m.answer(
+        await outbound.answer(
+            m,
             f"✅ Задача «<b>{title}</b>» сохранена.\n"
             f"Дедлайн: <b>{deadline.strftime('%d.%m.%Y %H:%M')}</b>\n\n"
             "Список активных задач — в кнопке <b>«📋 Мои задачи»</b>.",
@@ -332,6 +519,16 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
             parse_mode="HTML",
         )
 
+    async def missing_task_text(task_id: int, chat_id: int) -> str:
+        """
+        Почему задачи нет среди активных задач чата: уже закрыта или её тут нет.
+        В модели чтения только активные — за закрытыми идём в БД.
+        """
+        row = await get_task(task_id)
+        if row and row["chat_id"] == chat_id and row["status"] == "done":
+            return "Эта задача уже закрыта 🟢"
+        return "❌ Задача с таким ID не найдена в этом чате."
+
     # ────────────────────────────────
     # /done — старый способ закрыть задачу
     # ────────────────────────────────
@@ -339,18 +536,25 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
     async def done_cmd(m: types.Message):
         parts = m.text.split()
         if len(parts) < 2:
-            await m.answer("Используй: /done 5 (где 5 — номер задачи в БД)")
+            await outbound.answer(m, "Используй: /done 5 (где 5 — номер задачи в БД)")
             return
         try:
             task_id = int(parts[1])
         except ValueError:
-            await m.answer("ID должен быть числом")
+            await outbound.answer(m, "ID должен быть числом")
+            return
+
+        # чужую задачу не закрываем: в режиме воркеров её чат обслуживает другой процесс
+        task = ACTIVE.get(task_id)
+        if not task or task.chat_id != m.chat.id:
+            await outbound.answer(m, await missing_task_text(task_id, m.chat.id))
             return
 
-        mark_done(task_id)
+        await mark_done(task_id)
+        await cancel_task_reminders(reminders, task_id)
 
         # логируем закрытие
-        save_last_action(
+        await save_last_action(
             chat_id=m.chat.id,
             user_id=m.from_user.id,
             action_type="close_task",
@@ -358,7 +562,8 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
             completion_id=None,
         )
 
-        await m.answer(
+        await outbound.answer(
+            m,
             "🟢 Задача закрыта командой /done. Красавчик 👑",
             reply_markup=main_menu(),
         )
@@ -382,10 +587,16 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
         user = callback_query.from_user
         chat_id = callback_query.message.chat.id
 
-        completion_id = add_completion(task_id, user.id)
+        # кнопка под старым сообщением или подделанный callback_data
+        task = ACTIVE.get(task_id)
+        if not task or task.chat_id != chat_id:
+            await callback_query.answer(await missing_task_text(task_id, chat_id), show_alert=True)
+            return
+
+        completion_id = await add_completion(task_id, user.id)
 
         # логируем отметку выполнения
-        save_last_action(
+        await save_last_action(
             chat_id=chat_id,
             user_id=user.id,
             action_type="completion",
@@ -417,10 +628,16 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
         chat_id = callback_query.message.chat.id
         user_id = callback_query.from_user.id
 
-        mark_done(task_id)
+        task = ACTIVE.get(task_id)
+        if not task or task.chat_id != chat_id:
+            await callback_query.answer(await missing_task_text(task_id, chat_id), show_alert=True)
+            return
+
+        await mark_done(task_id)
+        await cancel_task_reminders(reminders, task_id)
 
         # логируем закрытие задачи
-        save_last_action(
+        await save_last_action(
             chat_id=chat_id,
             user_id=user_id,
             action_type="close_task",
@@ -437,7 +654,8 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
     async def close_cmd(m: types.Message):
         parts = m.text.split(maxsplit=1)
         if len(parts) < 2:
-            await m.answer(
+            await outbound.answer(
+                m,
                 "Чтобы закрыть задачу для всех, используй: /close 5",
                 parse_mode="Markdown",
             )
@@ -445,21 +663,23 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
         try:
             task_id = int(parts[1])
         except ValueError:
-            await m.answer(
+            await outbound.answer(
+                m,
                 "ID должен быть числом, например: /close 5",
                 parse_mode="Markdown",
             )
             return
 
-        task = get_task(task_id)
-        if not task or task["chat_id"] != m.chat.id:
-            await m.answer("❌ Задача с таким ID не найдена в этом чате.")
+        task = ACTIVE.get(task_id)
+        if not task or task.chat_id != m.chat.id:
+            await outbound.answer(m, await missing_task_text(task_id, m.chat.id))
             return
 
-        mark_done(task_id)
+        await mark_done(task_id)
+        await cancel_task_reminders(reminders, task_id)
 
         # логируем закрытие
-        save_last_action(
+        await save_last_action(
             chat_id=m.chat.id,
             user_id=m.from_user.id,
             action_type="close_task",
@@ -467,8 +687,9 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
             completion_id=None,
         )
 
-        await m.answer(
-            f"🔒 Задача #{task_id} «{task['title']}» закрыта и больше не будет в списке.",
+        await outbound.answer(
+            m,
+            f"🔒 Задача #{task_id} «{task.title}» закрыта и больше не будет в списке.",
             reply_markup=main_menu(),
         )
 
@@ -481,23 +702,26 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
         """
         1) Если пользователь сейчас вводит новую задачу (FSM),
            просто отменяем ввод.
-        2) Если действие уже выполнено — откатываем из last_actions.
+        2) Если действие уже выполнено — откатываем последнее из last_actions.
+           Повторный /undo откатывает предыдущее (до UNDO_DEPTH шагов назад).
         """
 
         # 1. Проверка FSM: (на всякий случай, вдруг остались в состоянии)
         current_state = await state.get_state()
         if current_state is not None:
             await state.finish()
-            await m.answer(
+            await outbound.answer(
+                m,
                 "Окей, отменяю ввод новой задачи. Ничего не сохранила 🙂",
                 reply_markup=main_menu(),
             )
             return
 
         # 2. Обычная отмена последнего действия в чате
-        action = get_last_action(m.chat.id)
+        action = await pop_last_action(m.chat.id)
         if not action:
-            await m.answer(
+            await outbound.answer(
+                m,
                 "Отменять пока нечего — последнее действие не найдено.",
                 reply_markup=main_menu(),
             )
@@ -507,30 +731,83 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
         task_id = action["task_id"]
         completion_id = action.get("completion_id")
 
-        task = get_task(task_id)
-        title = task["title"] if task else f"задача #{task_id}"
+        if action_type == "close_task":
+            # возвращаем задачу в active — заодно она снова появится в модели чтения
+            await restore_task_status(task_id)
+
+        task = ACTIVE.get(task_id)
+        if task is not None:
+            title = task.title
+        else:
+            # уже закрытой задачи в памяти нет — название берём из БД
+            row = await get_task(task_id)
+            title = row["title"] if row else f"задача #{task_id}"
 
         if action_type == "add_task":
-            # «отмена добавления» — просто скрываем задачу
-            mark_done(task_id)
+            # «отмена добавления» — скрываем задачу, в «🏁 Завершённые» она не попадает
+            await mark_done(task_id, status="undone")
+            await cancel_task_reminders(reminders, task_id)
             msg = f"↩️ Отменила добавление задачи: «{title}». Задача скрыта."
         elif action_type == "close_task":
-            # возвращаем задачу в active
-            restore_task_status(task_id)
+            if task:
+                # снова взводим напоминания, которые ещё впереди
+                await schedule_task_reminders(
+                    reminders,
+                    task_id=task_id,
+                    chat_id=task.chat_id,
+                    deadline=datetime.fromtimestamp(task.deadline_at, MOSCOW_TZ),
+                )
             msg = f"↩️ Отменила закрытие задачи: «{title}». Она снова активна."
         elif action_type == "completion":
             # снимаем отметку выполнения
             if completion_id is not None:
-                delete_completion(completion_id)
+                await delete_completion(completion_id)
                 msg = f"↩️ Отменила отметку выполнения задачи: «{title}»."
             else:
                 msg = "Не получилось отменить отметку выполнения — нет данных."
         else:
             msg = "Неизвестный тип действия — отмена невозможна."
 
-        clear_last_action(m.chat.id)
+        await outbound.answer(m, msg, reply_markup=main_menu())
+
+    # ────────────────────────────────
+    # /dbprofile — профилирование запросов к БД (только владелец бота)
+    # ────────────────────────────────
+    @dp.message_handler(commands=["dbprofile"])
+    async def db_profile_cmd(m: types.Message):
+        """
+        /dbprofile [report] — самые дорогие запросы
+        /dbprofile on [мс]  — включить (и задать порог медленного запроса)
+        /dbprofile off      — выключить
+        /dbprofile explain  — снимать EXPLAIN QUERY PLAN для медленных запросов
+        /dbprofile reset    — показать отчёт и обнулить статистику
+        """
+        if not owner_id or not m.from_user or m.from_user.id != owner_id:
+            return
+
+        args = m.get_args().split()
+        action = args[0] if args else "report"
+
+        if action == "on":
+            try:
+                slow_ms = float(args[1]) if len(args) > 1 else None
+            except ValueError:
+                await outbound.answer(m, "Порог — число миллисекунд, например: /dbprofile on 20")
+                return
+            await set_profiling(True, slow_ms=slow_ms)
+            text = "🔬 Профилирование запросов включено."
+        elif action == "off":
+            await set_profiling(False, explain=False)
+            text = "Профилирование запросов выключено."
+        elif action == "explain":
+            await set_profiling(True, explain=True)
+            text = "🔬 Профилирование включено, для медленных запросов снимаю EXPLAIN QUERY PLAN."
+        else:
+            rows = await profile_report(10, reset=(action == "reset"))
+            text = format_report(rows)
 
-        await m.answer(msg, reply_markup=main_menu())
+        # лимит Telegram — 4096 символов
+        await outbound.answer(m, text[:4000])
 
     # ────────────────────────────────
     # Отладочный хэндлер — всё, что не поймали другие
@@ -545,118 +822,3 @@ def register_handlers(dp: Dispatcher, scheduler: AsyncIOScheduler):
             m.text,
         )
 
-
-# ────────────────────────────────
-# Вспомогательные функции для напоминаний
-# ────────────────────────────────
-def _shift_to_work_morning(date_obj):
-    """
-    Берём datetime в московской таймзоне.
-    Если это суббота/воскресенье — сдвигаем на ближайший понедельник,
-    сохраняя время (часы и минуты).
-    """
-    from datetime import date as _date, datetime as _dt
-
-    # приводим вход в нормальный datetime
-    if isinstance(date_obj, _date) and not isinstance(date_obj, _dt):
-        # если вдруг пришла просто дата — оставим время 09:00
-        date_obj = _dt.combine(date_obj, time(9, 0))
-    elif not isinstance(date_obj, _dt):
-        date_obj = _dt.fromisoformat(str(date_obj))
-
-    # навешиваем московскую таймзону
-    if date_obj.tzinfo is None:
-        date_obj = date_obj.replace(tzinfo=MOSCOW_TZ)
-    else:
-        date_obj = date_obj.astimezone(MOSCOW_TZ)
-
-    # 5 = суббота, 6 = воскресенье
-    while date_obj.weekday() >= 5:
-        date_obj += timedelta(days=1)
-
-    return date_obj
-
-
-async def reminder_job(bot, task_id: int, chat_id: int, offset: int):
-    """
-    Джоба для APScheduler: перед отправкой проверяем,
-    что задача ещё active.
-    """
-    from app.db import get_task  # локальный импорт, чтобы избежать циклов
-
-    task = get_task(task_id)
-    if not task:
-        return
-
-    if task.get("status") != "active":
-        return
-
-    title = task.get("title", "без названия")
-
-    texts = {
-        3: f"⏳ Напоминание: через пару дней дедлайн по задаче: «{title}»",
-        1: f"⚡ Напоминание: завтра дедлайн по задаче: «{title}»",
-        0: f"🔥 Сегодня дедлайн по задаче: «{title}»",
-    }
-
-    text = texts.get(offset)
-    if not text:
-        return
-
-    await bot.send_message(chat_id, text)
-
-
-# ────────────────────────────────
-# Планирование напоминаний
-# ────────────────────────────────
-def schedule_task_jobs(
-    dp: Dispatcher,
-    task_id: int,
-    chat_id: int,
-    title: str,
-    deadline: datetime,
-    scheduler: AsyncIOScheduler,
-):
-    """
-    Планируем напоминания:
-    - за 3 дня до дедлайна (в то же время, что и дедлайн)
-    - за 1 день до дедлайна
-    - в день дедлайна
-    Если дата попадает на выходной (сб/вс) — переносим на ближайший понедельник,
-    но время оставляем тем же.
-    """
-    # приводим дедлайн к datetime в часовом поясе Москвы
-    if isinstance(deadline, str):
-        try:
-            deadline_dt = datetime.fromisoformat(deadline)
-        except ValueError:
-            return
-    else:
-        deadline_dt = deadline
-
-    if deadline_dt.tzinfo is None:
-        # считаем, что дедлайн задан по Москве
-        deadline_dt = deadline_dt.replace(tzinfo=MOSCOW_TZ)
-    else:
-        # приводим к Москве
-        deadline_dt = deadline_dt.astimezone(MOSCOW_TZ)
-
-    now_moscow = datetime.now(MOSCOW_TZ)
-
-    for offset in (3, 1, 0):
-        # datetime, относительно которого шлём напоминание (то же время, что дедлайн)
-        remind_dt = deadline_dt - timedelta(days=offset)
-
-        # приводим к рабочему дню, но сохраняем время
-        remind_dt = _shift_to_work_morning(remind_dt)
-
-        # если это время уже прошло — не планируем
-        if remind_dt <= now_moscow:
-            continue
-
-        scheduler.add_job(
-            reminder_job,
-            trigger="date",
-            run_date=remind_dt,
-            args=(dp.bot, task_id, chat_id, offset),
-        )
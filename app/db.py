@@ -1,8 +1,45 @@
+import heapq
+import itertools
 import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from app.db_profile import PROFILER, ProfilingConnection
+from app.read_model import ACTIVE, TaskRecord
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "bot.db")
+MOSCOW_TZ = ZoneInfo("Europe/Moscow")
+
+# Настройки соединения: WAL позволяет читать параллельно с записью,
+# synchronous=NORMAL в WAL-режиме безопасен и сильно дешевле FULL.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",      # ~16 МБ страничного кэша
+    "PRAGMA mmap_size=134217728",    # 128 МБ memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+# Сколько подготовленных выражений sqlite3 держит в кэше на соединение
+STATEMENT_CACHE_SIZE = 256
+# Сколько последних действий на (чат, пользователь) можно отменить через /undo
+UNDO_DEPTH = 20
+
+# Версия данных каждого чата: растёт после каждой записи, меняющей список
+# его задач (см. _bump_chat). По ней bot_handlers понимает, что отрисованный
+# список ещё актуален. Живёт в памяти процесса — апдейты одного чата всегда
+# приходят в один и тот же процесс (см. app/workers.py).
+_chat_versions: dict = {}
+
+_local = threading.local()
+# Меняется при включении/выключении профилирования — соединения пересоздаются
+_conn_generation = 0
+_all_conns: list = []
+_all_conns_lock = threading.Lock()
 
 
 def _dict_factory(cursor, row):
@@ -12,18 +49,148 @@ def _dict_factory(cursor, row):
     return d
 
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+def _connect():
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=5.0,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=ProfilingConnection if PROFILER.enabled else sqlite3.Connection,
+    )
     conn.row_factory = _dict_factory
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
-def init_db():
+def get_conn():
+    """
+    Долгоживущее соединение текущего потока.
+
+    Создаётся один раз на поток и переиспользуется всеми запросами,
+    поэтому кэш подготовленных выражений и страниц не теряется между вызовами.
+    Если DB_PATH поменяли (например, в бенчмарке) или переключили
+    профилирование — переподключаемся.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == DB_PATH and _local.generation == _conn_generation:
+        return conn
+
+    conn = _connect()
+    _local.conn = conn
+    _local.path = DB_PATH
+    _local.generation = _conn_generation
+    with _all_conns_lock:
+        _all_conns.append(conn)
+    return conn
+
+
+def close_db():
+    """
+    Закрыть все соединения (на остановке бота).
+    """
+    with _all_conns_lock:
+        conns = list(_all_conns)
+        _all_conns.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _local.__dict__.clear()
+
+
+def set_profiling(enabled: bool | None = None, slow_ms: float | None = None, explain: bool | None = None):
+    """
+    Включить или выключить профилирование запросов (см. app/db_profile.py).
+    Вызывать в потоке БД: его соединение тут же пересоздаётся.
+    """
+    global _conn_generation
+    was_enabled = PROFILER.enabled
+    PROFILER.configure(enabled=enabled, slow_ms=slow_ms, explain=explain)
+    if PROFILER.enabled != was_enabled:
+        _conn_generation += 1
+        conn = getattr(_local, "conn", None)
+        if conn is not None:
+            with _all_conns_lock:
+                if conn in _all_conns:
+                    _all_conns.remove(conn)
+            conn.close()
+            _local.conn = None
+
+
+def profile_report(top: int = 10, reset: bool = False) -> list:
+    rows = PROFILER.report(top)
+    if reset:
+        PROFILER.reset()
+    return rows
+
+
+@contextmanager
+def _transaction():
+    """
+    Транзакция на соединении текущего потока: commit при успехе, rollback при ошибке.
+    """
     conn = get_conn()
-    cur = conn.cursor()
+    with conn:
+        yield conn
+
+
+def _fetchall(sql: str, params=()):
+    return get_conn().execute(sql, params).fetchall()
+
+
+def _fetchone(sql: str, params=()):
+    return get_conn().execute(sql, params).fetchone()
+
+
+def _execute(sql: str, params=()):
+    with _transaction() as conn:
+        return conn.execute(sql, params)
+
+
+def chat_version(chat_id: int) -> int:
+    """
+    Текущая версия данных чата. Только память, без запроса к БД —
+    можно звать прямо из event loop.
+    """
+    return _chat_versions.get(chat_id, 0)
+
+
+def _bump_chat(chat_id):
+    # после commit: кто прочитал старую версию, увидит новые данные и просто пересчитает
+    if chat_id is not None:
+        _chat_versions[chat_id] = _chat_versions.get(chat_id, 0) + 1
+
+
+def _task_chat(conn, task_id: int):
+    row = conn.execute("SELECT chat_id FROM tasks WHERE id = ?", (task_id,)).fetchone()
+    return None if row is None else row["chat_id"]
+
+
+def deadline_to_epoch(deadline) -> int:
+    """
+    Дедлайн (datetime или ISO-строка) -> unix-время в секундах.
+    Дедлайн без таймзоны считаем московским, как и в планировщике.
+    """
+    if isinstance(deadline, str):
+        deadline = datetime.fromisoformat(deadline)
+    if deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=MOSCOW_TZ)
+    return int(deadline.timestamp())
+
 
+# ─────────────────────────────────────────────
+# Миграции схемы (версия хранится в PRAGMA user_version)
+# ─────────────────────────────────────────────
+
+def _migration_1(conn):
+    """
+    Базовая схема: задачи, отметки выполнения, последние действия.
+    CREATE IF NOT EXISTS — чтобы старые bot.db без версии тоже проходили.
+    """
     # Основная таблица задач
-    cur.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS tasks (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,7 +205,7 @@ def init_db():
     )
 
     # Таблица отметок выполнения задач
-    cur.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS task_completions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -51,7 +218,7 @@ def init_db():
     )
 
     # Таблица последних действий (для отмены)
-    cur.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS last_actions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -65,72 +232,445 @@ def init_db():
         """
     )
 
-    conn.commit()
-    conn.close()
 
+def _migration_2(conn):
+    """
+    Дедлайн в unix-секундах (deadline_at) и индексы под горячие запросы.
+    deadline_ts остаётся как есть — по нему рисуем дату в сообщениях.
+    """
+    conn.execute("ALTER TABLE tasks ADD COLUMN deadline_at INTEGER NOT NULL DEFAULT 0")
+
+    rows = conn.execute("SELECT id, deadline_ts FROM tasks").fetchall()
+    updates = []
+    for r in rows:
+        try:
+            updates.append((deadline_to_epoch(r["deadline_ts"]), r["id"]))
+        except ValueError:
+            continue
+    conn.executemany("UPDATE tasks SET deadline_at = ? WHERE id = ?", updates)
 
-def add_task(chat_id: int, title: str, deadline: datetime, creator_id: int) -> int:
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_chat_status_deadline "
+        "ON tasks(chat_id, status, deadline_at, id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_status_deadline "
+        "ON tasks(status, deadline_at)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_completions_task "
+        "ON task_completions(task_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_last_actions_chat_user "
+        "ON last_actions(chat_id, user_id, id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_last_actions_chat "
+        "ON last_actions(chat_id, id)"
+    )
+
+
+def _migration_3(conn):
+    """
+    Кэш профилей пользователей (username / имя) для списков выполнивших.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+        """
+    )
+
+
+def _migration_4(conn):
+    """
+    Напоминания живут в БД, а не в памяти планировщика.
+    Для уже существующих активных задач сразу заводим будущие напоминания.
+    """
+    from app.reminders import reminder_due_times  # локальный импорт, чтобы избежать циклов
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reminders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            offset_days INTEGER NOT NULL,    -- 3, 1, 0 дней до дедлайна
+            due_at INTEGER NOT NULL,         -- unix-время отправки
+            state TEXT NOT NULL DEFAULT 'pending',  -- 'pending', 'claimed', 'sent', 'cancelled', 'missed', 'failed'
+            UNIQUE(task_id, offset_days)
+        )
+        """
+    )
+    # в индексе только ожидающие — он остаётся маленьким, сколько бы ни было отправлено
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reminders_pending_due "
+        "ON reminders(due_at) WHERE state = 'pending'"
+    )
+
+    def rows():
+        # генератором, а не списком: на миллионе задач список съедал сотни МБ
+        tasks = conn.execute("SELECT id, chat_id, deadline_ts FROM tasks WHERE status = 'active'")
+        for t in tasks:
+            try:
+                due_times = reminder_due_times(t["deadline_ts"])
+            except ValueError:
+                continue
+            for offset, due_at in due_times:
+                yield (t["id"], t["chat_id"], offset, due_at)
+
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO reminders (task_id, chat_id, offset_days, due_at)
+        VALUES (?, ?, ?, ?)
+        """,
+        rows(),
+    )
+
+
+def _migration_5(conn):
+    """
+    Состояния FSM aiogram — чтобы переживали перезапуск и были общими
+    для нескольких процессов на одной машине.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',      -- JSON
+            bucket TEXT NOT NULL DEFAULT '{}',    -- JSON
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated "
+        "ON fsm_states(updated_at)"
+    )
+
+
+def _migration_6(conn):
+    """
+    Аренды (leases) — кто из процессов-воркеров сейчас владеет
+    общей фоновой работой (например, циклом напоминаний).
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _migration_7(conn):
+    """
+    Мелкие служебные значения процесса (например, максимальный
+    обработанный update_id для отсева повторных доставок).
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _migration_8(conn):
+    """
+    Журнал отмены ограничен UNDO_DEPTH действиями на (чат, пользователь):
+    дальше save_last_action подрезает его сама, а здесь разово
+    чистим историю, накопленную раньше.
+    """
+    conn.execute(
+        """
+        DELETE FROM last_actions
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY chat_id, user_id ORDER BY id DESC
+                ) AS n
+                FROM last_actions
+            )
+            WHERE n > ?
+        )
+        """,
+        (UNDO_DEPTH,),
+    )
+
+
+def _migration_9(conn):
+    """
+    Архив завершённых задач: старые done-задачи и их отметки переезжают
+    в *_archive (см. archive_done_tasks), чтобы в tasks оставались в основном
+    живые строки. closed_at — когда задачу закрыли (unix-время);
+    у закрытых раньше точного времени нет, берём дедлайн (но не позже «сейчас»).
+    """
+    conn.execute("ALTER TABLE tasks ADD COLUMN closed_at INTEGER")
+    conn.execute(
+        "UPDATE tasks SET closed_at = MIN(deadline_at, CAST(strftime('%s', 'now') AS INTEGER)) "
+        "WHERE status = 'done'"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_status_closed "
+        "ON tasks(status, closed_at)"
+    )
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tasks_archive (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            creator_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            deadline_ts TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            deadline_at INTEGER NOT NULL,
+            closed_at INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_archive_chat_closed "
+        "ON tasks_archive(chat_id, closed_at, id)"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS task_completions_archive (
+            id INTEGER PRIMARY KEY,
+            task_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            completed_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_completions_archive_task "
+        "ON task_completions_archive(task_id)"
+    )
+
+
+def _migration_10(conn):
+    """
+    Счётчик попыток отправки напоминания: не доставленное возвращается
+    в очередь, а после нескольких неудач переходит в 'failed'.
+    """
+    conn.execute("ALTER TABLE reminders ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+
+def _migration_11(conn):
+    """
+    Когда напоминание забрали в 'claimed': после смены владельца аренды
+    в очередь возвращаем только зависшие claim, а не те, что прежний
+    владелец, возможно, ещё отправляет.
+    """
+    conn.execute("ALTER TABLE reminders ADD COLUMN claimed_at INTEGER")
+    # зависшие claim ищем на каждом refill — индекс только по ним, он почти пуст
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reminders_claimed "
+        "ON reminders(claimed_at) WHERE state = 'claimed'"
+    )
+
+
+def _migration_12(conn):
+    """
+    Время последнего изменения значения в meta: отметку update_id,
+    которая давно не двигалась, нельзя считать действующей — после недели
+    без апдейтов Telegram начинает update_id заново.
+    """
+    conn.execute("ALTER TABLE meta ADD COLUMN updated_at INTEGER")
+
+
+
+def _migration_13(conn):
+    """
+    Индекс под страницу «🏁 Завершённые» по tasks: курсор (closed_at, id)
+    и LIMIT — прямо в индексе, без сортировки (см. get_done_tasks_page).
+    """
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_chat_status_closed "
+        "ON tasks(chat_id, status, closed_at, id)"
+    )
+
+
+MIGRATIONS = (
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+    _migration_6,
+    _migration_7,
+    _migration_8,
+    _migration_9,
+    _migration_10,
+    _migration_11,
+    _migration_12,
+    _migration_13,
+)
+
+
+def init_db():
+    """
+    Довести схему до последней версии.
+
+    Каждая миграция идёт в своей транзакции вместе с обновлением
+    user_version, так что старый bot.db обновляется на месте при старте,
+    а упавшая миграция откатывается целиком.
+    """
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        with conn:
+            # IMMEDIATE — чтобы два процесса не начали одну миграцию одновременно
+            conn.execute("BEGIN IMMEDIATE")
+            current = conn.execute("PRAGMA user_version").fetchone()["user_version"]
+            if current >= version:
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+
+
+def add_task(chat_id: int, title: str, deadline: datetime, creator_id: int) -> int:
+    cur = _execute(
         """
-        INSERT INTO tasks (chat_id, creator_id, title, deadline_ts, status, created_at)
-        VALUES (?, ?, ?, ?, 'active', ?)
+        INSERT INTO tasks (chat_id, creator_id, title, deadline_ts, deadline_at, status, created_at)
+        VALUES (?, ?, ?, ?, ?, 'active', ?)
         """,
         (
             chat_id,
             creator_id,
             title,
             deadline.isoformat(),
+            deadline_to_epoch(deadline),
             datetime.utcnow().isoformat(),
         ),
     )
-    task_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    return task_id
+    ACTIVE.add(TaskRecord(cur.lastrowid, chat_id, title, deadline_to_epoch(deadline)))
+    _bump_chat(chat_id)
+    return cur.lastrowid
 
 
-def get_tasks(chat_id: int):
+def _group_completers(rows: list) -> list:
     """
-    Вернуть активные задачи для чата.
+    Строки «задача × отметка» из LEFT JOIN (столбец completer_id, строки одной
+    задачи подряд) -> задачи со списком user_id в ключе "completers".
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT * FROM tasks
-        WHERE chat_id = ? AND status = 'active'
-        ORDER BY datetime(deadline_ts) ASC
+    tasks = []
+    for r in rows:
+        completer_id = r.pop("completer_id")
+        if not tasks or tasks[-1]["id"] != r["id"]:
+            r["completers"] = []
+            tasks.append(r)
+        if completer_id is not None:
+            tasks[-1]["completers"].append(completer_id)
+    return tasks
+
+
+def get_tasks_page(chat_id: int, limit: int, after=None, before=None):
+    """
+    Одна страница активных задач чата (keyset-пагинация по (deadline_at, id)).
+
+    after=(deadline_at, id) — следующая страница после этой задачи,
+    before=(deadline_at, id) — предыдущая страница перед ней,
+    без курсора — первая страница.
+
+    Возвращает (tasks, has_more): задачи в порядке дедлайна, у каждой ключ
+    "completers" со списком user_id; has_more — есть ли ещё задачи
+    дальше в направлении листания. Отметки подтягиваются тем же запросом
+    и только для задач страницы.
+    """
+    if after is not None:
+        where, order, params = "AND (deadline_at, id) > (?, ?)", "ASC", tuple(after)
+    elif before is not None:
+        where, order, params = "AND (deadline_at, id) < (?, ?)", "DESC", tuple(before)
+    else:
+        where, order, params = "", "ASC", ()
+
+    rows = _fetchall(
+        f"""
+        WITH page AS (
+            SELECT * FROM tasks
+            WHERE chat_id = ? AND status = 'active' {where}
+            ORDER BY deadline_at {order}, id {order}
+            LIMIT ?
+        )
+        SELECT page.*, c.user_id AS completer_id
+        FROM page
+        LEFT JOIN task_completions AS c ON c.task_id = page.id
+        ORDER BY page.deadline_at ASC, page.id ASC, c.id ASC
         """,
-        (chat_id,),
+        (chat_id, *params, limit + 1),
     )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+
+    tasks = _group_completers(rows)
+
+    has_more = len(tasks) > limit
+    if has_more:
+        # лишняя задача — самая дальняя в направлении листания
+        tasks = tasks[1:] if before is not None else tasks[:limit]
+    return tasks, has_more
 
 
-def mark_done(task_id: int):
+def mark_done(task_id: int, status: str = "done"):
     """
     Пометить задачу как завершённую (больше не показывается в списке).
+    status='undone' — задачу убрали отменой добавления: её нет
+    и в «🏁 Завершённых», и архиватор её не трогает.
+    """
+    with _transaction() as conn:
+        conn.execute(
+            "UPDATE tasks SET status = ?, closed_at = ? WHERE id = ?",
+            (status, int(time.time()), task_id),
+        )
+        chat_id = _task_chat(conn, task_id)
+    ACTIVE.remove(task_id)
+    _bump_chat(chat_id)
+
+
+def load_read_model(shard: tuple | None = None) -> int:
+    """
+    Загрузить активные задачи в модель чтения (app/read_model.py).
+    Курсоры без _dict_factory: на миллионе строк dict на каждую — лишние секунды.
+    Возвращает, сколько задач загружено.
     """
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE tasks SET status='done' WHERE id = ?", (task_id,))
-    conn.commit()
-    conn.close()
+    tasks = conn.cursor()
+    tasks.row_factory = None
+    tasks.execute("SELECT id, chat_id, title, deadline_at FROM tasks WHERE status = 'active'")
+    completions = conn.cursor()
+    completions.row_factory = None
+    completions.execute(
+        """
+        SELECT c.task_id, c.user_id FROM task_completions AS c
+        JOIN tasks AS t ON t.id = c.task_id
+        WHERE t.status = 'active'
+        ORDER BY c.id
+        """
+    )
+    ACTIVE.load(tasks, completions, shard=shard)
+    return len(ACTIVE)
 
 
 def get_active_tasks():
     """
     Все активные задачи (для пересоздания напоминаний на старте бота).
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM tasks WHERE status='active'")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return _fetchall(
+        "SELECT * FROM tasks WHERE status='active' ORDER BY deadline_at ASC"
+    )
 
 
 # ─────────────────────────────────────────────
@@ -138,52 +678,43 @@ def get_active_tasks():
 # ─────────────────────────────────────────────
 
 def add_completion(task_id: int, user_id: int) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        INSERT INTO task_completions (task_id, user_id, completed_at)
-        VALUES (?, ?, ?)
-        """,
-        (task_id, user_id, datetime.utcnow().isoformat()),
-    )
-    conn.commit()
-    completion_id = cur.lastrowid
-    conn.close()
-    return completion_id
+    with _transaction() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO task_completions (task_id, user_id, completed_at)
+            VALUES (?, ?, ?)
+            """,
+            (task_id, user_id, datetime.utcnow().isoformat()),
+        )
+        chat_id = _task_chat(conn, task_id)
+    ACTIVE.add_completer(task_id, user_id)
+    _bump_chat(chat_id)
+    return cur.lastrowid
 
 
 def get_task(task_id: int):
     """
     Получить одну задачу по id.
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    task = _fetchone("SELECT * FROM tasks WHERE id = ?", (task_id,))
+    if task is None:
+        # давно закрытые задачи лежат в архиве
+        task = _fetchone("SELECT * FROM tasks_archive WHERE id = ?", (task_id,))
+    return task
 
 
-def get_task_completions(task_id: int):
+def get_tasks_by_ids(task_ids: list):
     """
-    Получить всех пользователей, отметивших задачу выполненной.
+    Несколько задач одним запросом: {task_id: row}.
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT * FROM task_completions
-        WHERE task_id = ?
-        ORDER BY datetime(completed_at) ASC
-        """,
-        (task_id,),
+    if not task_ids:
+        return {}
+    placeholders = ",".join("?" * len(task_ids))
+    rows = _fetchall(
+        f"SELECT * FROM tasks WHERE id IN ({placeholders})",
+        tuple(task_ids),
     )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return {r["id"]: r for r in rows}
 
 
 # ─────────────────────────────────────────────
@@ -197,96 +728,594 @@ def save_last_action(
     task_id: int,
     completion_id: int | None = None,
 ):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute(
+    """
+    Записать действие в журнал отмены.
+    Заодно срезаем то, что вышло за UNDO_DEPTH у этого пользователя в чате:
+    обычно это одна строка, и находится она по индексу (chat_id, user_id, id).
+    """
+    with _transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO last_actions (chat_id, user_id, action_type, task_id, completion_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (chat_id, user_id, action_type, task_id, completion_id, datetime.utcnow().isoformat()),
+        )
+        conn.execute(
+            """
+            DELETE FROM last_actions
+            WHERE chat_id = ? AND user_id = ? AND id <= (
+                SELECT id FROM last_actions
+                WHERE chat_id = ? AND user_id = ?
+                ORDER BY id DESC
+                LIMIT 1 OFFSET ?
+            )
+            """,
+            (chat_id, user_id, chat_id, user_id, UNDO_DEPTH),
+        )
+
+
+def pop_last_action(chat_id: int, user_id: int | None = None):
+    """
+    Достать последнее действие и убрать его из журнала (одной транзакцией,
+    чтобы два /undo подряд не откатили одно и то же).
+    Следующий вызов вернёт предыдущее действие — так /undo шагает назад по истории.
+    """
+    with _transaction() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if user_id is None:
+            row = conn.execute(
+                "SELECT * FROM last_actions WHERE chat_id = ? ORDER BY id DESC LIMIT 1",
+                (chat_id,),
+            ).fetchone()
+        else:
+            row = conn.execute(
+                """
+                SELECT * FROM last_actions
+                WHERE chat_id = ? AND user_id = ?
+                ORDER BY id DESC
+                LIMIT 1
+                """,
+                (chat_id, user_id),
+            ).fetchone()
+        if row is not None:
+            conn.execute("DELETE FROM last_actions WHERE id = ?", (row["id"],))
+    return row
+
+
+def restore_task_status(task_id: int):
+    """
+    Возвращаем задачу в статус 'active'.
+    Если задачу уже унесло в архив — сначала возвращаем её оттуда вместе с отметками.
+    """
+    with _transaction() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _unarchive_task(conn, task_id)
+        conn.execute(
+            "UPDATE tasks SET status = 'active', closed_at = NULL WHERE id = ?",
+            (task_id,),
+        )
+        task = conn.execute(
+            "SELECT id, chat_id, title, deadline_at FROM tasks WHERE id = ?",
+            (task_id,),
+        ).fetchone()
+        completers = conn.execute(
+            "SELECT user_id FROM task_completions WHERE task_id = ? ORDER BY id",
+            (task_id,),
+        ).fetchall()
+    if task is None:
+        return
+    ACTIVE.add(
+        TaskRecord(
+            task["id"],
+            task["chat_id"],
+            task["title"],
+            task["deadline_at"],
+            tuple(r["user_id"] for r in completers),
+        )
+    )
+    _bump_chat(task["chat_id"])
+
+
+def delete_completion(completion_id: int):
+    with _transaction() as conn:
+        row = conn.execute(
+            """
+            SELECT t.chat_id, c.task_id, c.user_id FROM task_completions AS c
+            JOIN tasks AS t ON t.id = c.task_id
+            WHERE c.id = ?
+            """,
+            (completion_id,),
+        ).fetchone()
+        conn.execute("DELETE FROM task_completions WHERE id = ?", (completion_id,))
+        conn.execute("DELETE FROM task_completions_archive WHERE id = ?", (completion_id,))
+    if row is not None:
+        ACTIVE.remove_completer(row["task_id"], row["user_id"])
+        _bump_chat(row["chat_id"])
+
+
+# ─────────────────────────────────────────────
+# Архив завершённых задач
+# ─────────────────────────────────────────────
+
+_TASK_COLUMNS = "id, chat_id, creator_id, title, deadline_ts, status, created_at, deadline_at, closed_at"
+_COMPLETION_COLUMNS = "id, task_id, user_id, completed_at"
+
+
+def archive_done_tasks(closed_before: int, batch: int = 500) -> int:
+    """
+    Перенести в архив до batch задач, закрытых раньше closed_before,
+    вместе с их отметками; их отработанные напоминания просто удаляем.
+    Одна пачка — одна короткая транзакция. Возвращает, сколько задач перенесли.
+    """
+    with _transaction() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        ids = [
+            r["id"]
+            for r in conn.execute(
+                """
+                SELECT id FROM tasks
+                WHERE status = 'done' AND closed_at < ?
+                ORDER BY closed_at
+                LIMIT ?
+                """,
+                (closed_before, batch),
+            ).fetchall()
+        ]
+        if not ids:
+            return 0
+        placeholders = ",".join("?" * len(ids))
+        conn.execute(
+            f"INSERT OR REPLACE INTO tasks_archive ({_TASK_COLUMNS}) "
+            f"SELECT {_TASK_COLUMNS} FROM tasks WHERE id IN ({placeholders})",
+            ids,
+        )
+        conn.execute(
+            f"INSERT OR REPLACE INTO task_completions_archive ({_COMPLETION_COLUMNS}) "
+            f"SELECT {_COMPLETION_COLUMNS} FROM task_completions WHERE task_id IN ({placeholders})",
+            ids,
+        )
+        conn.execute(f"DELETE FROM task_completions WHERE task_id IN ({placeholders})", ids)
+        conn.execute(f"DELETE FROM reminders WHERE task_id IN ({placeholders})", ids)
+        conn.execute(f"DELETE FROM tasks WHERE id IN ({placeholders})", ids)
+    return len(ids)
+
+
+def _unarchive_task(conn, task_id: int):
+    """
+    Вернуть задачу и её отметки из архива (внутри уже открытой транзакции).
+    """
+    moved = conn.execute(
+        f"INSERT OR IGNORE INTO tasks ({_TASK_COLUMNS}) "
+        f"SELECT {_TASK_COLUMNS} FROM tasks_archive WHERE id = ?",
+        (task_id,),
+    ).rowcount
+    if not moved:
+        return
+    conn.execute(
+        f"INSERT OR IGNORE INTO task_completions ({_COMPLETION_COLUMNS}) "
+        f"SELECT {_COMPLETION_COLUMNS} FROM task_completions_archive WHERE task_id = ?",
+        (task_id,),
+    )
+    conn.execute("DELETE FROM task_completions_archive WHERE task_id = ?", (task_id,))
+    conn.execute("DELETE FROM tasks_archive WHERE id = ?", (task_id,))
+
+
+def get_done_tasks_page(chat_id: int, limit: int, after=None):
+    """
+    Одна страница завершённых задач чата, от недавно закрытых к старым
+    (keyset-пагинация по (closed_at, id)): недавние ещё в tasks, остальные — в архиве.
+
+    after=(closed_at, id) — следующая страница после этой задачи.
+    Возвращает (tasks, has_more), у каждой задачи ключ "completers" —
+    список user_id, как в get_tasks_page.
+
+    Каждая таблица — своим запросом по индексу (chat_id, [status,] closed_at, id):
+    курсор и LIMIT срабатывают внутри индекса, обе отдают не больше limit + 1
+    строк уже по порядку, и остаётся слить их здесь.
+    """
+    if after is not None:
+        where, params = "AND (closed_at, id) < (?, ?)", tuple(after)
+    else:
+        where, params = "", ()
+
+    with _transaction() as conn:
+        # один снимок на все запросы: архиватор в другом процессе
+        # не перенесёт задачу между ними
+        conn.execute("BEGIN")
+        recent = conn.execute(
+            f"""
+            SELECT id, title, deadline_ts, closed_at FROM tasks
+            WHERE chat_id = ? AND status = 'done' {where}
+            ORDER BY closed_at DESC, id DESC
+            LIMIT ?
+            """,
+            (chat_id, *params, limit + 1),
+        ).fetchall()
+        archived = conn.execute(
+            f"""
+            SELECT id, title, deadline_ts, closed_at FROM tasks_archive
+            WHERE chat_id = ? {where}
+            ORDER BY closed_at DESC, id DESC
+            LIMIT ?
+            """,
+            (chat_id, *params, limit + 1),
+        ).fetchall()
+        tasks = list(
+            itertools.islice(
+                heapq.merge(
+                    recent, archived, key=lambda t: (t["closed_at"], t["id"]), reverse=True
+                ),
+                limit + 1,
+            )
+        )
+        has_more = len(tasks) > limit
+        tasks = tasks[:limit]
+        if not tasks:
+            return [], False
+
+        ids = [t["id"] for t in tasks]
+        placeholders = ",".join("?" * len(ids))
+        completions = conn.execute(
+            f"""
+            SELECT id, task_id, user_id FROM task_completions
+            WHERE task_id IN ({placeholders})
+            UNION ALL
+            SELECT id, task_id, user_id FROM task_completions_archive
+            WHERE task_id IN ({placeholders})
+            ORDER BY id
+            """,
+            (*ids, *ids),
+        ).fetchall()
+
+    by_id = {}
+    for t in tasks:
+        t["completers"] = []
+        by_id[t["id"]] = t
+    for c in completions:
+        by_id[c["task_id"]]["completers"].append(c["user_id"])
+    return tasks, has_more
+
+
+# ─────────────────────────────────────────────
+# Профили пользователей (кэш имён)
+# ─────────────────────────────────────────────
+
+def upsert_users(users: list):
+    """
+    Сохранить профили: список кортежей (user_id, username, full_name, updated_at).
+    """
+    with _transaction() as conn:
+        conn.executemany(
+            """
+            INSERT INTO users (user_id, username, full_name, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username,
+                full_name = excluded.full_name,
+                updated_at = excluded.updated_at
+            """,
+            users,
+        )
+
+
+def get_users(user_ids: list):
+    """
+    Профили по списку id: {user_id: row}. Кого нет в БД — просто нет в ответе.
+    """
+    if not user_ids:
+        return {}
+    placeholders = ",".join("?" * len(user_ids))
+    rows = _fetchall(
+        f"SELECT * FROM users WHERE user_id IN ({placeholders})",
+        tuple(user_ids),
+    )
+    return {r["user_id"]: r for r in rows}
+
+
+# ─────────────────────────────────────────────
+# Напоминания
+# ─────────────────────────────────────────────
+
+def add_reminders(task_id: int, chat_id: int, due_times: list):
+    """
+    Запланировать напоминания по задаче: due_times — список (offset_days, due_at).
+    Отменённые ранее напоминания (задачу закрывали) заводятся заново —
+    с новым id, чтобы их увидел опрос новых напоминаний (get_new_pending_reminders);
+    уже отправленные не трогаем.
+    Возвращает ожидающие напоминания задачи: список (id, task_id, due_at).
+    """
+    with _transaction() as conn:
+        conn.execute(
+            "DELETE FROM reminders WHERE task_id = ? AND state = 'cancelled'",
+            (task_id,),
+        )
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO reminders (task_id, chat_id, offset_days, due_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            [(task_id, chat_id, offset, due_at) for offset, due_at in due_times],
+        )
+        rows = conn.execute(
+            "SELECT id, task_id, due_at FROM reminders WHERE task_id = ? AND state = 'pending'",
+            (task_id,),
+        ).fetchall()
+    return [(r["id"], r["task_id"], r["due_at"]) for r in rows]
+
+
+def cancel_task_reminders(task_id: int):
+    """
+    Отменить все ещё не отправленные напоминания задачи.
+    """
+    _execute(
+        "UPDATE reminders SET state = 'cancelled' WHERE task_id = ? AND state = 'pending'",
+        (task_id,),
+    )
+
+
+def get_pending_reminders_between(after: int, until: int):
+    """
+    Ожидающие напоминания с after < due_at <= until: список (id, task_id, due_at).
+    Диапазонный запрос по частичному индексу — для подгрузки окна.
+    """
+    rows = _fetchall(
         """
-        INSERT INTO last_actions (chat_id, user_id, action_type, task_id, completion_id, created_at)
-        VALUES (?, ?, ?, ?, ?, ?)
+        SELECT id, task_id, due_at FROM reminders
+        WHERE state = 'pending' AND due_at > ? AND due_at <= ?
+        ORDER BY due_at ASC
         """,
-        (chat_id, user_id, action_type, task_id, completion_id, datetime.utcnow().isoformat()),
+        (after, until),
     )
-    conn.commit()
-    conn.close()
+    return [(r["id"], r["task_id"], r["due_at"]) for r in rows]
 
 
-def get_last_action(chat_id: int, user_id: int | None = None):
+def last_reminder_id() -> int:
+    row = _fetchone("SELECT MAX(id) AS id FROM reminders")
+    return row["id"] or 0
+
+
+def get_new_pending_reminders(after_id: int, until: int, limit: int = 1000):
+    """
+    Напоминания, заведённые после after_id (в том числе другими процессами),
+    которые ждут отправки и наступают не позже until; просматриваем не больше limit строк.
+    Возвращает (список (id, task_id, due_at), новый after_id). Поиск по первичному ключу.
     """
-    Получить последнее действие.
+    rows = _fetchall(
+        "SELECT id, task_id, due_at, state FROM reminders WHERE id > ? ORDER BY id LIMIT ?",
+        (after_id, limit),
+    )
+    if not rows:
+        return [], after_id
+    pending = [
+        (r["id"], r["task_id"], r["due_at"])
+        for r in rows
+        if r["state"] == "pending" and r["due_at"] <= until
+    ]
+    return pending, rows[-1]["id"]
+
 
-    Если передан user_id — берём последнюю запись
-    именно этого пользователя в данном чате.
-    Если нет — работаем по-старому, только по chat_id.
+def claim_reminders(reminder_ids: list, now: int):
+    """
+    Забрать конкретные напоминания, если они всё ещё 'pending'.
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    if not reminder_ids:
+        return []
+    placeholders = ",".join("?" * len(reminder_ids))
+    with _transaction() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            f"""
+            SELECT * FROM reminders
+            WHERE id IN ({placeholders}) AND state = 'pending'
+            ORDER BY due_at ASC
+            """,
+            tuple(reminder_ids),
+        ).fetchall()
+        if rows:
+            conn.executemany(
+                "UPDATE reminders SET state = 'claimed', claimed_at = ? WHERE id = ?",
+                [(now, r["id"]) for r in rows],
+            )
+    return rows
+
 
-    if user_id is None:
-        cur.execute(
+def skip_missed_reminders(now: int, grace: int) -> int:
+    """
+    Не отправлять то, что безнадёжно опоздало (бот лежал): переводим в 'missed'
+    напоминания, просроченные больше чем на grace секунд, и «за N дней»
+    по задачам, дедлайн которых уже прошёл. Возвращает, сколько пропустили.
+    """
+    cur = _execute(
+        """
+        UPDATE reminders SET state = 'missed'
+        WHERE state = 'pending' AND due_at <= ? AND (
+            due_at < ?
+            OR (offset_days > 0 AND task_id IN (SELECT id FROM tasks WHERE deadline_at <= ?))
+        )
+        """,
+        (now, now - grace, now),
+    )
+    return cur.rowcount
+
+
+def claim_due_reminders(now: int, limit: int):
+    """
+    Забрать пачку наступивших напоминаний: переводим их в 'claimed'
+    в той же транзакции, чтобы никто другой их не отправил повторно.
+    """
+    with _transaction() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
             """
-            SELECT *
-            FROM last_actions
-            WHERE chat_id = ?
-            ORDER BY created_at DESC, id DESC
-            LIMIT 1
+            SELECT * FROM reminders
+            WHERE state = 'pending' AND due_at <= ?
+            ORDER BY due_at ASC
+            LIMIT ?
             """,
-            (chat_id,),
+            (now, limit),
+        ).fetchall()
+        if rows:
+            conn.executemany(
+                "UPDATE reminders SET state = 'claimed', claimed_at = ? WHERE id = ?",
+                [(now, r["id"]) for r in rows],
+            )
+    return rows
+
+
+def finish_reminders(reminder_ids: list, state: str = "sent"):
+    with _transaction() as conn:
+        conn.executemany(
+            "UPDATE reminders SET state = ? WHERE id = ?",
+            [(state, reminder_id) for reminder_id in reminder_ids],
         )
-    else:
-        cur.execute(
+
+
+def retry_reminders(reminder_ids: list, retry_at: int, max_attempts: int) -> list:
+    """
+    Не доставленные напоминания: вернуть в 'pending' с новым due_at,
+    а исчерпавшие max_attempts попыток — в 'failed'.
+    Возвращает вернувшиеся в очередь: список (id, task_id, due_at).
+    """
+    with _transaction() as conn:
+        conn.executemany(
             """
-            SELECT *
-            FROM last_actions
-            WHERE chat_id = ? AND user_id = ?
-            ORDER BY created_at DESC, id DESC
-            LIMIT 1
+            UPDATE reminders SET
+                attempts = attempts + 1,
+                state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                due_at = ?
+            WHERE id = ?
             """,
-            (chat_id, user_id),
+            [(max_attempts, retry_at, reminder_id) for reminder_id in reminder_ids],
         )
+        placeholders = ",".join("?" * len(reminder_ids))
+        rows = conn.execute(
+            f"SELECT id, task_id, due_at FROM reminders "
+            f"WHERE id IN ({placeholders}) AND state = 'pending'",
+            tuple(reminder_ids),
+        ).fetchall()
+    return [(r["id"], r["task_id"], r["due_at"]) for r in rows]
 
-    row = cur.fetchone()
-    conn.close()
-    return dict(row) if row else None
 
+def release_claimed_reminders(claimed_before: int) -> int:
+    """
+    Вернуть в очередь напоминания, которые забрали раньше claimed_before,
+    но так и не отметили (процесс упал или завис между claim и finish).
+    Свежие claim не трогаем — их, возможно, ещё отправляет прежний
+    владелец аренды. Возвращает, сколько вернули.
+    """
+    cur = _execute(
+        """
+        UPDATE reminders SET state = 'pending'
+        WHERE state = 'claimed' AND (claimed_at IS NULL OR claimed_at < ?)
+        """,
+        (claimed_before,),
+    )
+    return cur.rowcount
 
-def clear_last_action(chat_id: int, user_id: int | None = None):
+
+# ─────────────────────────────────────────────
+# Состояния FSM
+# ─────────────────────────────────────────────
+
+def get_fsm_state(chat_id: int, user_id: int):
+    return _fetchone(
+        "SELECT * FROM fsm_states WHERE chat_id = ? AND user_id = ?",
+        (chat_id, user_id),
+    )
+
+
+def save_fsm_states(upserts: list, deletes: list):
+    """
+    Записать пачку изменений FSM одной транзакцией.
+    upserts — кортежи (chat_id, user_id, state, data_json, bucket_json, updated_at),
+    deletes — кортежи (chat_id, user_id) для опустевших записей.
     """
-    Очистить последнюю запись.
+    with _transaction() as conn:
+        if upserts:
+            conn.executemany(
+                """
+                INSERT INTO fsm_states (chat_id, user_id, state, data, bucket, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(chat_id, user_id) DO UPDATE SET
+                    state = excluded.state,
+                    data = excluded.data,
+                    bucket = excluded.bucket,
+                    updated_at = excluded.updated_at
+                """,
+                upserts,
+            )
+        if deletes:
+            conn.executemany(
+                "DELETE FROM fsm_states WHERE chat_id = ? AND user_id = ?",
+                deletes,
+            )
+
 
-    Если user_id не указан — удаляем все записи по чату (старое поведение).
-    Если указан — чистим только действия конкретного пользователя.
+def delete_expired_fsm_states(before: int) -> int:
     """
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+    Удалить состояния, которые не менялись с момента before. Возвращает число удалённых.
+    """
+    cur = _execute("DELETE FROM fsm_states WHERE updated_at < ?", (before,))
+    return cur.rowcount
 
-    if user_id is None:
-        cur.execute("DELETE FROM last_actions WHERE chat_id = ?", (chat_id,))
-    else:
-        cur.execute(
-            "DELETE FROM last_actions WHERE chat_id = ? AND user_id = ?",
-            (chat_id, user_id),
+
+# ─────────────────────────────────────────────
+# Аренды между процессами
+# ─────────────────────────────────────────────
+
+def acquire_lease(name: str, owner: str, ttl: float, now: float | None = None) -> bool:
+    """
+    Взять или продлить аренду name на ttl секунд.
+    Получится, если аренда свободна, протухла или уже наша.
+    """
+    now = time.time() if now is None else now
+    with _transaction() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            """
+            INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                owner = excluded.owner,
+                expires_at = excluded.expires_at
+            WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+            """,
+            (name, owner, now + ttl, now),
         )
+        row = conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+    return row is not None and row["owner"] == owner
+
 
-    conn.commit()
-    conn.close()
+def release_lease(name: str, owner: str):
+    """
+    Отдать аренду сразу (при штатной остановке), не дожидаясь истечения ttl.
+    """
+    _execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
 
 
-def restore_task_status(task_id: int):
+# ─────────────────────────────────────────────
+# Служебные значения
+# ─────────────────────────────────────────────
+
+def get_meta(key: str):
     """
-    Возвращаем задачу в статус 'active'.
+    Запись meta: {"value", "updated_at"} или None.
+    updated_at у записей, сделанных до миграции 12, — NULL.
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE tasks SET status = 'active' WHERE id = ?", (task_id,))
-    conn.commit()
-    conn.close()
+    return _fetchone("SELECT value, updated_at FROM meta WHERE key = ?", (key,))
 
 
-def delete_completion(completion_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM task_completions WHERE id = ?", (completion_id,))
-    conn.commit()
-    conn.close()
+def set_meta(key: str, value: int, updated_at: int):
+    """
+    Записать value как есть — в том числе меньше прежнего
+    (отметка update_id после сброса нумерации в Telegram).
+    """
+    _execute(
+        """
+        INSERT INTO meta (key, value, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET
+            value = excluded.value,
+            updated_at = excluded.updated_at
+        """,
+        (key, value, updated_at),
+    )
@@ -0,0 +1,94 @@
+# app/db_async.py
+"""
+Асинхронный доступ к БД.
+
+Все функции app.db выполняются в отдельном потоке БД (очередь запросов
+ThreadPoolExecutor на один поток), поэтому хэндлеры и напоминания
+не блокируют event loop aiogram, пока SQLite читает или пишет.
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import db
+from app.metrics import DB_SECONDS
+
+# Один поток — одно долгоживущее соединение и последовательные записи
+# (SQLite всё равно допускает только одного писателя).
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+
+async def run(func, *args, **kwargs):
+    """
+    Выполнить синхронную функцию БД в потоке БД и дождаться результата.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+def _async(func):
+    timer = DB_SECONDS.labels(func.__name__)
+
+    def timed(*args, **kwargs):
+        # меряем в потоке БД — без времени ожидания в очереди к нему
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timer.observe(time.perf_counter() - started)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(timed, *args, **kwargs)
+
+    return wrapper
+
+
+init_db = _async(db.init_db)
+add_task = _async(db.add_task)
+get_tasks_page = _async(db.get_tasks_page)
+mark_done = _async(db.mark_done)
+get_active_tasks = _async(db.get_active_tasks)
+load_read_model = _async(db.load_read_model)
+add_completion = _async(db.add_completion)
+get_task = _async(db.get_task)
+get_tasks_by_ids = _async(db.get_tasks_by_ids)
+save_last_action = _async(db.save_last_action)
+pop_last_action = _async(db.pop_last_action)
+restore_task_status = _async(db.restore_task_status)
+delete_completion = _async(db.delete_completion)
+archive_done_tasks = _async(db.archive_done_tasks)
+get_done_tasks_page = _async(db.get_done_tasks_page)
+upsert_users = _async(db.upsert_users)
+get_users = _async(db.get_users)
+add_reminders = _async(db.add_reminders)
+cancel_task_reminders = _async(db.cancel_task_reminders)
+get_pending_reminders_between = _async(db.get_pending_reminders_between)
+last_reminder_id = _async(db.last_reminder_id)
+get_new_pending_reminders = _async(db.get_new_pending_reminders)
+claim_reminders = _async(db.claim_reminders)
+skip_missed_reminders = _async(db.skip_missed_reminders)
+claim_due_reminders = _async(db.claim_due_reminders)
+finish_reminders = _async(db.finish_reminders)
+retry_reminders = _async(db.retry_reminders)
+release_claimed_reminders = _async(db.release_claimed_reminders)
+get_fsm_state = _async(db.get_fsm_state)
+save_fsm_states = _async(db.save_fsm_states)
+delete_expired_fsm_states = _async(db.delete_expired_fsm_states)
+acquire_lease = _async(db.acquire_lease)
+release_lease = _async(db.release_lease)
+get_meta = _async(db.get_meta)
+set_meta = _async(db.set_meta)
+set_profiling = _async(db.set_profiling)
+profile_report = _async(db.profile_report)
+
+
+async def close():
+    """
+    Закрыть соединение в потоке БД и остановить сам поток.
+    """
+    await run(db.close_db)
+    _executor.shutdown(wait=True)
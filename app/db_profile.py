@@ -0,0 +1,226 @@
+# app/db_profile.py
+"""
+Профилирование запросов app/db.py.
+
+Для каждой пары (функция app/db.py, SQL) считаем вызовы, время и число
+возвращённых строк; запросы дольше slow_ms пишем в лог, а при explain=True
+заодно снимаем для них EXPLAIN QUERY PLAN (по одному разу на запрос).
+
+Включается переменной окружения DB_PROFILE=1 (порог — DB_SLOW_MS,
+планы — DB_EXPLAIN=1) или командой владельца /dbprofile.
+Пока выключено, соединения — обычные sqlite3.Connection и профилировщик
+не стоит ничего: при переключении поток БД просто переподключается
+с другим классом соединения (см. get_conn в app/db.py).
+"""
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Служебные функции app/db.py: время относим к тем, кто их вызвал
+_HELPERS = {"_fetchall", "_fetchone", "_execute", "_transaction", "__enter__", "__exit__"}
+# Для таких выражений план не нужен
+_NO_PLAN_PREFIXES = ("BEGIN", "COMMIT", "ROLLBACK", "PRAGMA", "CREATE", "ALTER", "DROP")
+
+
+def _caller() -> str:
+    """
+    Имя функции app/db.py, из которой пришёл запрос.
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_globals.get("__name__") == "app.db" and frame.f_code.co_name not in _HELPERS:
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return "?"
+
+
+def _short(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+class QueryProfiler:
+    """
+    slow_ms — с какой длительности запрос считаем медленным,
+    explain — снимать ли EXPLAIN QUERY PLAN для медленных запросов.
+    """
+
+    def __init__(self, enabled: bool = False, slow_ms: float = 50, explain: bool = False):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self._stats: dict = {}   # (function, sql) -> [calls, seconds, rows, slow]
+        self._plans: dict = {}   # sql -> [строки плана]
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool | None = None, slow_ms: float | None = None, explain: bool | None = None):
+        if enabled is not None:
+            self.enabled = enabled
+        if slow_ms is not None:
+            self.slow_ms = slow_ms
+        if explain is not None:
+            self.explain = explain
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._plans.clear()
+
+    def add(self, key: tuple, seconds: float, rows: int, calls: int = 0):
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                entry = self._stats[key] = [0, 0.0, 0, 0]
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] += rows
+
+    def finish(self, key: tuple, seconds: float, rows: int, params, conn):
+        """
+        Запрос выполнен целиком (выборка дочитана): проверяем порог.
+        """
+        if seconds * 1000 < self.slow_ms:
+            return
+        function, sql = key
+        with self._lock:
+            self._stats[key][3] += 1
+        logger.warning(
+            "Медленный запрос в %s: %.1f мс, строк %s: %s",
+            function,
+            seconds * 1000,
+            rows,
+            _short(sql),
+        )
+        if self.explain and sql not in self._plans:
+            plan = self._capture_plan(sql, params, conn)
+            if plan:
+                self._plans[sql] = plan
+                logger.warning("План запроса:\n%s", "\n".join(plan))
+
+    @staticmethod
+    def _capture_plan(sql: str, params, conn) -> list:
+        if _short(sql).upper().startswith(_NO_PLAN_PREFIXES):
+            return []
+        try:
+            # обычный курсор — чтобы сам EXPLAIN не попал в статистику
+            rows = sqlite3.Cursor(conn).execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        except sqlite3.Error as e:
+            logger.info("EXPLAIN не удался: %s", e)
+            return []
+        return [row["detail"] if isinstance(row, dict) else str(row[-1]) for row in rows]
+
+    def report(self, top: int = 10) -> list:
+        """
+        Самые дорогие по суммарному времени запросы.
+        """
+        with self._lock:
+            items = [(key, list(entry)) for key, entry in self._stats.items()]
+        items.sort(key=lambda item: item[1][1], reverse=True)
+        return [
+            {
+                "function": function,
+                "sql": _short(sql),
+                "calls": calls,
+                "total_ms": round(seconds * 1000, 2),
+                "avg_ms": round(seconds * 1000 / calls, 3) if calls else 0.0,
+                "rows": rows,
+                "slow": slow,
+                "plan": self._plans.get(sql, []),
+            }
+            for (function, sql), (calls, seconds, rows, slow) in items[:top]
+        ]
+
+
+PROFILER = QueryProfiler(
+    enabled=os.getenv("DB_PROFILE") == "1",
+    slow_ms=float(os.getenv("DB_SLOW_MS", 50)),
+    explain=os.getenv("DB_EXPLAIN") == "1",
+)
+
+
+# ────────────────────────────────
+# Соединение и курсор с замерами
+# ────────────────────────────────
+class ProfilingCursor(sqlite3.Cursor):
+    """
+    Время запроса = execute + дочитывание выборки (SQLite выполняет
+    SELECT по мере fetch), поэтому замер закрываем в fetchone/fetchall.
+    """
+
+    _key = None
+    _params = ()
+    _seconds = 0.0
+
+    def execute(self, sql, params=()):
+        self._key = (_caller(), sql)
+        self._params = params
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._seconds = time.perf_counter() - started
+            PROFILER.add(self._key, self._seconds, 0, calls=1)
+            if self.description is None:
+                # не выборка — запрос уже выполнен целиком
+                PROFILER.finish(self._key, self._seconds, max(self.rowcount, 0), params, self.connection)
+
+    def executemany(self, sql, seq_of_params):
+        key = (_caller(), sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            seconds = time.perf_counter() - started
+            rows = max(self.rowcount, 0)
+            PROFILER.add(key, seconds, rows, calls=1)
+            PROFILER.finish(key, seconds, rows, (), self.connection)
+
+    def _fetched(self, started: float, rows: int):
+        seconds = time.perf_counter() - started
+        self._seconds += seconds
+        PROFILER.add(self._key, seconds, rows)
+        PROFILER.finish(self._key, self._seconds, rows, self._params, self.connection)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        if self._key is not None:
+            self._fetched(started, 0 if row is None else 1)
+        return row
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        if self._key is not None:
+            self._fetched(started, len(rows))
+        return rows
+
+
+class ProfilingConnection(sqlite3.Connection):
+    def execute(self, sql, params=()):
+        return self.cursor(ProfilingCursor).execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor(ProfilingCursor).executemany(sql, seq_of_params)
+
+
+def format_report(rows: list) -> str:
+    """
+    Отчёт для сообщения в чат.
+    """
+    if not rows:
+        return "Статистики пока нет."
+    lines = []
+    for i, row in enumerate(rows, 1):
+        lines.append(
+            f"{i}. {row['function']}: {row['calls']} выз., всего {row['total_ms']} мс, "
+            f"в среднем {row['avg_ms']} мс, строк {row['rows']}, медленных {row['slow']}"
+        )
+        lines.append(f"   {row['sql'][:200]}")
+        for detail in row["plan"]:
+            lines.append(f"   ↳ {detail}")
+    return "\n".join(lines)
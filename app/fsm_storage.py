@@ -0,0 +1,237 @@
+# app/fsm_storage.py
+"""
+Хранилище состояний FSM aiogram поверх SQLite бота.
+
+Состояние «жду строку с задачей» переживает перезапуск и видно
+нескольким процессам на одной машине. Чтение идёт из кэша в памяти
+(get_state вызывается на каждый апдейт), запись сразу попадает в кэш,
+а в БД уходит пачками раз в flush_interval секунд.
+Состояния, которые не трогали дольше ttl, удаляются.
+
+Кэш локален для процесса, поэтому при нескольких процессах
+апдейты одного чата должны попадать в один и тот же процесс
+(так и работает режим воркеров с шардированием по chat_id).
+"""
+import asyncio
+import copy
+import json
+import logging
+import time
+import typing
+from collections import OrderedDict
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from app import db_async
+
+logger = logging.getLogger(__name__)
+
+
+def _empty_record() -> dict:
+    return {"state": None, "data": {}, "bucket": {}, "updated_at": 0}
+
+
+def _is_empty(record: dict) -> bool:
+    return record["state"] is None and not record["data"] and not record["bucket"]
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    flush_interval — как часто сбрасываем накопленные изменения в БД,
+    ttl — через сколько секунд без изменений состояние считаем протухшим,
+    cache_size — сколько пар (чат, пользователь) держим в памяти.
+    """
+
+    def __init__(self, flush_interval: float = 0.5, ttl: int = 24 * 3600, cache_size: int = 50000):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.cache_size = cache_size
+
+        self._cache: OrderedDict = OrderedDict()  # (chat_id, user_id) -> record
+        self._dirty: dict = {}                    # (chat_id, user_id) -> record
+        self._flusher: asyncio.Task | None = None
+        self._next_expire = 0
+
+    # ────────────────────────────────
+    # Кэш и сброс в БД
+    # ────────────────────────────────
+    def _key(self, chat, user) -> tuple:
+        chat, user = self.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    async def _load(self, key: tuple) -> dict:
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+            if not _is_empty(record) and record["updated_at"] < time.time() - self.ttl:
+                # протухло, пока лежало в кэше; из БД его уберёт периодическая чистка
+                record.update(_empty_record())
+            return record
+
+        record = self._dirty.get(key)
+        if record is None:
+            row = await db_async.get_fsm_state(*key)
+            if row is None or row["updated_at"] < time.time() - self.ttl:
+                record = _empty_record()
+            else:
+                record = {
+                    "state": row["state"],
+                    "data": json.loads(row["data"]),
+                    "bucket": json.loads(row["bucket"]),
+                    "updated_at": row["updated_at"],
+                }
+            # пока ждали БД, запись могла появиться в кэше — она свежее
+            if key in self._cache:
+                return self._cache[key]
+
+        self._remember(key, record)
+        return record
+
+    def _remember(self, key: tuple, record: dict):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _touch(self, key: tuple, record: dict):
+        record["updated_at"] = int(time.time())
+        self._remember(key, record)
+        self._dirty[key] = record
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() >= self._next_expire:
+                    self._next_expire = time.time() + 600
+                    removed = await db_async.delete_expired_fsm_states(int(time.time() - self.ttl))
+                    if removed:
+                        logger.info("FSM: удалено протухших состояний: %s", removed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("FSM: не удалось сохранить состояния")
+
+    async def flush(self):
+        """
+        Записать все накопленные изменения одной транзакцией.
+        """
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+
+        upserts, deletes = [], []
+        for (chat_id, user_id), record in dirty.items():
+            if _is_empty(record):
+                deletes.append((chat_id, user_id))
+            else:
+                upserts.append(
+                    (
+                        chat_id,
+                        user_id,
+                        record["state"],
+                        json.dumps(record["data"], ensure_ascii=False),
+                        json.dumps(record["bucket"], ensure_ascii=False),
+                        record["updated_at"],
+                    )
+                )
+        try:
+            await db_async.save_fsm_states(upserts, deletes)
+        except Exception:
+            # не потерять изменения: вернём то, что не успели перезаписать заново
+            for key, record in dirty.items():
+                self._dirty.setdefault(key, record)
+            raise
+
+    # ────────────────────────────────
+    # Интерфейс BaseStorage
+    # ────────────────────────────────
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        self._cache.clear()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        record = await self._load(self._key(chat, user))
+        if record["state"] is None:
+            return self.resolve_state(default)
+        return record["state"]
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._load(self._key(chat, user))
+        return copy.deepcopy(record["data"])
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        key = self._key(chat, user)
+        record = await self._load(key)
+        record["state"] = self.resolve_state(state)
+        self._touch(key, record)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        key = self._key(chat, user)
+        record = await self._load(key)
+        record["data"] = copy.deepcopy(data or {})
+        self._touch(key, record)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        key = self._key(chat, user)
+        record = await self._load(key)
+        record["data"].update(data or {}, **kwargs)
+        self._touch(key, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._load(self._key(chat, user))
+        return copy.deepcopy(record["bucket"])
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        key = self._key(chat, user)
+        record = await self._load(key)
+        record["bucket"] = copy.deepcopy(bucket or {})
+        self._touch(key, record)
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None,
+                            **kwargs):
+        key = self._key(chat, user)
+        record = await self._load(key)
+        record["bucket"].update(bucket or {}, **kwargs)
+        self._touch(key, record)
@@ -0,0 +1,375 @@
+# app/ingest.py
+"""
+Приём апдейтов вебхука через очередь.
+
+Раньше апдейт обрабатывался прямо внутри HTTP-запроса Telegram: пока
+хэндлер ждал БД или get_chat, запрос висел, и под нагрузкой Telegram
+начинал слать апдейты повторно. Теперь вебхук только кладёт апдейт
+в ограниченную очередь и сразу отвечает 200, а обрабатывают апдейты
+concurrency фоновых обработчиков:
+- апдейты одного чата идут строго по очереди (один в работе на чат),
+- разные чаты обрабатываются параллельно,
+- очередь переполнена — вебхук отвечает 503, и Telegram повторит позже.
+Глубину очереди, задержку до начала обработки и отказы видно через stats().
+
+Повторные доставки одного и того же апдейта (Telegram не дождался ответа)
+отсеиваются по update_id ещё до очереди — см. UpdateDedup.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiohttp import web
+
+from app import db_async
+
+logger = logging.getLogger(__name__)
+
+# Поля апдейта, у которых есть chat
+_CHAT_FIELDS = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+)
+
+
+def update_chat_id(update: dict) -> int:
+    """
+    chat_id сырого апдейта (0, если чата у апдейта нет).
+    По нему держим порядок внутри чата и шардируем по воркерам.
+    """
+    for field in _CHAT_FIELDS:
+        obj = update.get(field)
+        if obj:
+            return obj["chat"]["id"]
+
+    query = update.get("callback_query")
+    if query:
+        message = query.get("message")
+        if message:
+            return message["chat"]["id"]
+        return query["from"]["id"]
+
+    # inline-запросы, опросы и прочее — по автору
+    for obj in update.values():
+        if isinstance(obj, dict) and "from" in obj:
+            return obj["from"]["id"]
+    return 0
+
+
+class UpdateDedup:
+    """
+    Отсев повторно доставленных апдейтов по update_id.
+
+    В памяти — кольцо из size последних update_id. В БД — отметка (ключ meta
+    key, у каждого воркера свой), ниже которой все апдейты точно обработаны:
+    после перезапуска всё, что не больше неё, считаем уже обработанным.
+    Отметка не обгоняет апдейты, которые ещё в очереди или в работе, и те,
+    что мы недавно отклонили (503) — Telegram пришлёт их снова;
+    отклонённые держат её не дольше reject_hold секунд.
+    save_every — как часто сохраняем отметку.
+
+    Отметка, которая не двигалась дольше max_age секунд, больше не действует:
+    повторно Telegram шлёт апдейты не старше суток, а после недели без
+    апдейтов начинает update_id заново, со случайного и, возможно, меньшего
+    числа — со старой отметкой все новые апдейты выглядели бы повторами.
+    """
+
+    META_KEY = "update_id_hwm"
+
+    def __init__(
+        self,
+        size: int = 10000,
+        save_every: float = 5,
+        key: str = META_KEY,
+        reject_hold: float = 3600,
+        max_age: float = 24 * 3600,
+    ):
+        self.size = size
+        self.save_every = save_every
+        self.key = key
+        self.reject_hold = reject_hold
+        self.max_age = max_age
+        self._ring: deque = deque()
+        self._seen: set = set()
+        self._unfinished: dict = {}  # update_id -> до какого времени держит отметку
+        self._restart_hwm = 0   # всё, что до перезапуска
+        self._hwm = 0
+        self._saved_hwm = 0
+        self._moved_at = 0.0    # когда отметка последний раз двигалась (time.time())
+        self._saver: asyncio.Task | None = None
+
+    async def start(self):
+        row = await db_async.get_meta(self.key)
+        if row is not None:
+            self._restart_hwm = self._saved_hwm = self._hwm = row["value"]
+            # запись старше миграции — считаем свежей, как раньше
+            self._moved_at = row["updated_at"] or time.time()
+        self._saver = asyncio.create_task(self._save_loop())
+
+    async def stop(self):
+        if self._saver is not None:
+            self._saver.cancel()
+            try:
+                await self._saver
+            except asyncio.CancelledError:
+                pass
+            self._saver = None
+        await self.save()
+
+    def seen(self, update_id: int) -> bool:
+        if self._hwm and time.time() - self._moved_at > self.max_age:
+            self._forget_all()
+        return update_id <= self._restart_hwm or update_id in self._seen
+
+    def _forget_all(self):
+        logger.info("Отметка update_id %s устарела, начинаем заново", self._hwm)
+        self._ring.clear()
+        self._seen.clear()
+        self._unfinished.clear()
+        self._restart_hwm = self._hwm = 0
+
+    def remember(self, update_id: int):
+        if len(self._ring) >= self.size:
+            self._seen.discard(self._ring.popleft())
+        self._ring.append(update_id)
+        self._seen.add(update_id)
+        self._unfinished[update_id] = float("inf")
+        if update_id > self._hwm:
+            self._hwm = update_id
+            self._moved_at = time.time()
+
+    def done(self, update_id: int):
+        """
+        Апдейт обработан (успешно или с ошибкой) — он больше не держит отметку.
+        """
+        self._unfinished.pop(update_id, None)
+
+    def rejected(self, update_id: int):
+        """
+        Апдейт не приняли (очередь полна) — Telegram его повторит.
+        """
+        self._unfinished.setdefault(update_id, time.monotonic() + self.reject_hold)
+
+    def safe_mark(self) -> int:
+        """
+        Наибольший update_id, до которого включительно всё обработано.
+        """
+        now = time.monotonic()
+        expired = [u for u, until in self._unfinished.items() if until < now]
+        for update_id in expired:
+            del self._unfinished[update_id]
+        if self._unfinished:
+            return min(self._hwm, min(self._unfinished) - 1)
+        return self._hwm
+
+    async def save(self):
+        mark = self.safe_mark()
+        # после _forget_all отметка может стать меньше сохранённой — пишем как есть
+        if mark != self._saved_hwm:
+            await db_async.set_meta(self.key, mark, int(self._moved_at))
+            self._saved_hwm = mark
+
+    async def _save_loop(self):
+        while True:
+            await asyncio.sleep(self.save_every)
+            try:
+                await self.save()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Не удалось сохранить последний update_id")
+
+
+class UpdateQueue:
+    """
+    concurrency — сколько апдейтов (из разных чатов) обрабатываем одновременно,
+    maxsize — сколько апдейтов может ждать в очереди,
+    warn_depth — с какой глубины очереди пишем предупреждение в лог,
+    dedup — отсев повторных доставок (None — без отсева).
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        concurrency: int = 8,
+        maxsize: int = 1000,
+        warn_depth: int = 200,
+        dedup: UpdateDedup | None = None,
+    ):
+        self.dp = dp
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self.warn_depth = warn_depth
+        self.dedup = dedup
+
+        self._chats: dict = {}        # chat_id -> deque[(enqueued_at, update)]
+        self._ready = asyncio.Queue() # чаты, у которых есть апдейт и ни одного в работе
+        self._depth = 0
+        self._in_flight = 0
+        self._peak_depth = 0
+        self._processed = 0
+        self._errors = 0
+        self._rejected = 0
+        self._duplicates = 0
+        self._wait_avg = 0.0
+        self._wait_max = 0.0
+        self._warned = False
+
+        self._space = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._consumers: list = []
+
+    # ────────────────────────────────
+    # Публичный интерфейс
+    # ────────────────────────────────
+    async def start(self):
+        if self.dedup is not None:
+            await self.dedup.start()
+        self._consumers = [
+            asyncio.create_task(self._consume()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self, timeout: float = 10):
+        """
+        Дать обработчикам доделать то, что уже принято (не дольше timeout),
+        и остановить их.
+        """
+        if self._depth or self._in_flight:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Остановка: в очереди апдейтов осталось %s", self._depth)
+        for task in self._consumers:
+            task.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+        if self.dedup is not None:
+            await self.dedup.stop()
+
+    def put_nowait(self, chat_id: int, update: types.Update) -> bool:
+        """
+        Положить апдейт в очередь. False — очередь полна, апдейт не принят.
+        Повторную доставку уже принятого апдейта молча «принимаем» и выбрасываем.
+        """
+        dedup = self.dedup
+        if dedup is not None and dedup.seen(update.update_id):
+            self._duplicates += 1
+            return True
+
+        if self._depth >= self.maxsize:
+            self._rejected += 1
+            if dedup is not None:
+                dedup.rejected(update.update_id)
+            return False
+
+        if dedup is not None:
+            dedup.remember(update.update_id)
+
+        items = self._chats.get(chat_id)
+        if items is None:
+            items = self._chats[chat_id] = deque()
+            self._ready.put_nowait(chat_id)
+        items.append((time.monotonic(), update))
+
+        self._depth += 1
+        self._idle.clear()
+        if self._depth > self._peak_depth:
+            self._peak_depth = self._depth
+        if self._depth >= self.warn_depth and not self._warned:
+            self._warned = True
+            logger.warning("Очередь апдейтов растёт: %s ждут обработки", self._depth)
+        return True
+
+    async def put(self, chat_id: int, update: types.Update):
+        """
+        То же, но при полной очереди ждём, пока освободится место.
+        """
+        while self._depth >= self.maxsize:
+            self._space.clear()
+            await self._space.wait()
+        self.put_nowait(chat_id, update)
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._depth,
+            "peak_depth": self._peak_depth,
+            "in_flight": self._in_flight,
+            "chats_waiting": len(self._chats),
+            "processed": self._processed,
+            "errors": self._errors,
+            "rejected": self._rejected,
+            "duplicates": self._duplicates,
+            "wait_avg": round(self._wait_avg, 4),
+            "wait_max": round(self._wait_max, 4),
+        }
+
+    # ────────────────────────────────
+    # Внутренности
+    # ────────────────────────────────
+    async def _consume(self):
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+
+        while True:
+            chat_id = await self._ready.get()
+            items = self._chats[chat_id]
+            enqueued_at, update = items.popleft()
+            self._depth -= 1
+            self._in_flight += 1
+            self._space.set()
+
+            wait = time.monotonic() - enqueued_at
+            # скользящее среднее: видно, как давно апдейты начали залёживаться
+            self._wait_avg += (wait - self._wait_avg) * 0.05
+            self._wait_max = max(self._wait_max, wait)
+
+            try:
+                await self.dp.process_update(update)
+                self._processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._errors += 1
+                logger.exception("Ошибка обработки апдейта %s", update.update_id)
+            finally:
+                self._in_flight -= 1
+                if self.dedup is not None:
+                    self.dedup.done(update.update_id)
+                if items:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._chats[chat_id]
+
+                if self._depth < self.warn_depth // 2:
+                    self._warned = False
+                if not self._depth and not self._in_flight:
+                    self._idle.set()
+
+
+class QueuedWebhookHandler(WebhookRequestHandler):
+    """
+    Вебхук, который не ждёт обработки: кладёт апдейт в dp["ingest"]
+    и сразу отвечает Telegram.
+    """
+
+    async def post(self):
+        self.validate_ip()
+        dispatcher = self.get_dispatcher()
+        data = await self.request.json()
+
+        if not dispatcher["ingest"].put_nowait(update_chat_id(data), types.Update(**data)):
+            return web.Response(status=503, text="busy")
+        return web.Response(text="ok")
@@ -1,17 +1,22 @@
 # app/main.py
 import os
 import logging
-from datetime import datetime
 from urllib.parse import urlparse, urlunparse
 
 from aiogram import Bot, Dispatcher
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.utils import executor
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.utils.executor import Executor
+from aiohttp import web
 from dotenv import load_dotenv
 
-from app.db import init_db, get_active_tasks
-from app.bot_handlers import register_handlers, schedule_task_jobs
+from app import db_async, metrics
+from app.archive import TaskArchiver
+from app.fsm_storage import SQLiteStorage
+from app.ingest import QueuedWebhookHandler, UpdateDedup, UpdateQueue
+from app.bot_handlers import register_handlers
+from app.outbound import OutboundQueue
+from app.reminders import ReminderEngine
+from app.users import UserCache, UserCacheMiddleware
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,6 +25,10 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Например: https://telegram-task-bot-team-final.onrender.com
+# Свой адрес Bot API (локальный telegram-bot-api или заглушка в нагрузочном тесте)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Владелец бота: ему доступны служебные команды (/dbprofile)
+OWNER_ID = int(os.getenv("OWNER_ID") or 0)
 
 if not BOT_TOKEN:
     raise SystemExit("⚠️ BOT_TOKEN не задан")
@@ -42,70 +51,160 @@ else:
 WEBAPP_HOST = "0.0.0.0"
 WEBAPP_PORT = int(os.getenv("PORT", 10000))
 
+# Напоминания в памяти держим только на ближайшие N секунд, остальное — в БД
+REMINDER_HORIZON_SEC = int(os.getenv("REMINDER_HORIZON_SEC", 6 * 3600))
+REMINDER_REFILL_SEC = int(os.getenv("REMINDER_REFILL_SEC", 300))
+# Напоминания одного чата в пределах N секунд отправляем одной сводкой
+REMINDER_COALESCE_SEC = int(os.getenv("REMINDER_COALESCE_SEC", 60))
+# Напоминания, опоздавшие больше чем на N секунд (бот был выключен), не отправляем
+REMINDER_GRACE_SEC = int(os.getenv("REMINDER_GRACE_SEC", 3600))
+# В режиме воркеров: как часто владелец напоминаний проверяет, не завели ли
+# другие воркеры напоминания внутри уже загруженного окна
+REMINDER_POLL_SEC = int(os.getenv("REMINDER_POLL_SEC", 5))
+# Забранное в отправку, но не отмеченное дольше N секунд напоминание считаем
+# зависшим (воркер упал) и возвращаем в очередь
+REMINDER_CLAIM_TIMEOUT_SEC = int(os.getenv("REMINDER_CLAIM_TIMEOUT_SEC", 600))
+
+# Сколько сообщений в секунду бот отправляет в сумме (лимит Telegram ~30)
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 30))
+
+# Апдейты вебхука: сколько обрабатываем одновременно и сколько может ждать в очереди
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", 8))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 1000))
+
+# Завершённые задачи старше N дней переносим в архив (проверка раз в ARCHIVE_EVERY_SEC)
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_EVERY_SEC = int(os.getenv("ARCHIVE_EVERY_SEC", 3600))
+
+# Сколько процессов-воркеров обрабатывают апдейты (1 — всё в одном процессе)
+WORKERS = int(os.getenv("WORKERS", 1))
+# Сколько апдейтов может ждать в очереди одного воркера, дальше фронт отвечает 503
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", 1000))
+# Как часто воркер отдаёт фронту снимок своих метрик для /metrics
+METRICS_SNAPSHOT_SEC = float(os.getenv("METRICS_SNAPSHOT_SEC", 5))
+
 logger.info(f"BOOT: WEBHOOK_URL={WEBHOOK_URL}, WEBHOOK_PATH={WEBHOOK_PATH}")
 
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
 
-scheduler = AsyncIOScheduler()
-register_handlers(dp, scheduler)
+def create_bot() -> Bot:
+    if TELEGRAM_API_URL:
+        return Bot(token=BOT_TOKEN, server=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    return Bot(token=BOT_TOKEN)
+
+
+def create_dispatcher(workers: int = 1, index: int = 0) -> Dispatcher:
+    """
+    Собрать всё, что нужно одному процессу: бота, диспетчер с хэндлерами,
+    очередь апдейтов, очередь исходящих, цикл напоминаний и архиватор
+    (лежат в dp["ingest"], dp["outbound"], dp["reminders"] и dp["archiver"]).
+
+    В режиме воркеров общий лимит бота на отправку делим между процессами поровну,
+    а отметку обработанных апдейтов каждый воркер (index) хранит свою.
+    """
+    bot = create_bot()
+    dp = Dispatcher(bot, storage=SQLiteStorage())
+
+    outbound = OutboundQueue(global_rate=OUTBOUND_GLOBAL_RATE / workers)
+    reminders = ReminderEngine(
+        bot,
+        outbound,
+        horizon=REMINDER_HORIZON_SEC,
+        refill_every=REMINDER_REFILL_SEC,
+        coalesce_window=REMINDER_COALESCE_SEC,
+        grace=REMINDER_GRACE_SEC,
+        poll_every=REMINDER_POLL_SEC if workers > 1 else 0,
+        claim_timeout=REMINDER_CLAIM_TIMEOUT_SEC,
+    )
+    user_cache = UserCache()
+    dp.middleware.setup(UserCacheMiddleware(user_cache))
+    register_handlers(dp, reminders, user_cache, outbound, owner_id=OWNER_ID)
+    metrics.instrument_handlers(dp)
+
+    ingest = UpdateQueue(
+        dp,
+        concurrency=INGEST_CONCURRENCY,
+        maxsize=INGEST_QUEUE_SIZE,
+        dedup=UpdateDedup(
+            key=UpdateDedup.META_KEY if workers == 1 else f"{UpdateDedup.META_KEY}:{index}"
+        ),
+    )
+    metrics.PENDING.set_function(lambda: ingest.depth, "updates")
+    metrics.PENDING.set_function(lambda: outbound.depth, "outbound")
+    metrics.PENDING.set_function(lambda: reminders.window_size, "reminders_window")
+
+    dp["ingest"] = ingest
+    dp["outbound"] = outbound
+    dp["reminders"] = reminders
+    dp["archiver"] = TaskArchiver(age_days=ARCHIVE_AFTER_DAYS, every=ARCHIVE_EVERY_SEC)
+    return dp
 
 
 async def on_startup(dp: Dispatcher):
     logger.info("🚀 on_startup: инициализируем БД, планировщик и вебхук")
 
-    init_db()
+    await db_async.init_db()
     logger.info("✅ База инициализирована")
 
-    tasks = get_active_tasks()
-    for t in tasks:
-        try:
-            deadline = datetime.fromisoformat(t["deadline_ts"])
-        except Exception:
-            continue
-
-        schedule_task_jobs(
-            dp=dp,
-            task_id=t["id"],
-            chat_id=t["chat_id"],
-            title=t["title"],
-            deadline=deadline,
-            scheduler=scheduler,
-        )
+    # активные задачи — в память, списки дальше читаются без БД
+    loaded = await db_async.load_read_model()
+    logger.info(f"📚 Активных задач в памяти: {loaded}")
+
+    dp["outbound"].start()
+    await dp["ingest"].start()
 
-    scheduler.start()
-    logger.info("⏰ Планировщик запущен")
+    # напоминания уже лежат в БД — запускаем цикл, окно он подгрузит сам в фоне
+    dp["reminders"].start()
+    logger.info("⏰ Напоминания запущены")
+
+    dp["archiver"].start()
 
     # Ставим webhook на нормализованный WEBHOOK_URL
-    await bot.set_webhook(WEBHOOK_URL)
+    await dp.bot.set_webhook(WEBHOOK_URL)
     logger.info(f"🌐 Webhook установлен: {WEBHOOK_URL}")
 
 
 async def on_shutdown(dp: Dispatcher):
     logger.info("🛑 Остановка, гасим планировщик и ресурсы (webhook НЕ трогаем)")
 
+    # сначала дообрабатываем принятые апдейты — им ещё нужны БД и отправка
+    await dp["ingest"].stop()
+
     try:
-        scheduler.shutdown(wait=False)
+        await dp["reminders"].stop()
     except Exception as e:
         logger.warning(f"Ошибка при остановке планировщика: {e}")
 
+    await dp["archiver"].stop()
+    await dp["outbound"].stop()
+
     await dp.storage.close()
     await dp.storage.wait_closed()
 
+    await db_async.close()
+
     # Убираем deprecated доступ к bot.session, но если хочешь – можно оставить как было
-    session = await bot.get_session()
+    session = await dp.bot.get_session()
     await session.close()
 
 if __name__ == "__main__":
-    logger.info("🌍 Запуск webhook-сервера через aiogram.executor")
-
-    executor.start_webhook(
-        dispatcher=dp,
-        webhook_path=WEBHOOK_PATH,
-        on_startup=on_startup,
-        on_shutdown=on_shutdown,
-        skip_updates=True,
-        host=WEBAPP_HOST,
-        port=WEBAPP_PORT,
-    )
+    if WORKERS > 1:
+        from app.workers import run_front
+
+        logger.info(f"🌍 Запуск фронта вебхука и {WORKERS} воркеров")
+        run_front(WORKERS)
+    else:
+        logger.info("🌍 Запуск webhook-сервера через aiogram.executor")
+
+        web_app = web.Application()
+        web_app.router.add_get("/metrics", metrics.handle_metrics)
+
+        executor = Executor(create_dispatcher(), skip_updates=True)
+        executor.on_startup(on_startup)
+        executor.on_shutdown(on_shutdown)
+        # вебхук отвечает сразу, апдейты обрабатывает dp["ingest"]
+        executor.set_webhook(
+            webhook_path=WEBHOOK_PATH,
+            request_handler=QueuedWebhookHandler,
+            web_app=web_app,
+        )
+        executor.run_app(host=WEBAPP_HOST, port=WEBAPP_PORT)
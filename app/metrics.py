@@ -0,0 +1,337 @@
+# app/metrics.py
+"""
+Метрики в текстовом формате Prometheus (маршрут /metrics).
+
+Без внешних зависимостей и почти без затрат на горячем пути:
+- дочерние серии (handler="list_tasks" и т.п.) создаются один раз
+  при регистрации, а не на каждый запрос;
+- observe/inc — пара сложений в заранее выделенном списке, без блокировок
+  (каждую серию пишет один поток: event loop или поток БД);
+- очереди и окно напоминаний не считаем на ходу, а читаем при скрейпе (Gauge).
+
+В режиме воркеров (app/workers.py) серии живут в процессах воркеров.
+Каждый воркер раз в несколько секунд сбрасывает снимок своих серий
+в общий каталог (write_snapshot), а /metrics фронта отдаёт их вместе
+со своими, с меткой worker (read_snapshots + render).
+"""
+import bisect
+import functools
+import json
+import os
+import time
+
+from aiohttp import web
+
+# Границы корзин для времени, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600)
+
+_REGISTRY: list = []
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ────────────────────────────────
+# Типы метрик
+# ────────────────────────────────
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict = {}
+        # у метрики без меток единственная серия создаётся сразу
+        self._default = None if self.labelnames else self.labels()
+        _REGISTRY.append(self)
+
+    def labels(self, *values):
+        """
+        Серия с конкретными значениями меток. Вызывать при настройке,
+        а результат держать у себя — тогда на горячем пути нет поиска в dict.
+        """
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def items(self) -> list:
+        """
+        Пары (значения меток, серия) — для отчётов бенчмарков.
+        """
+        return list(self._children.items())
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def dump(self) -> list:
+        """
+        Серии в виде, пригодном для JSON: [[значения меток, данные], ...].
+        """
+        return [[list(values), self._dump_child(child)] for values, child in self._children.items()]
+
+    def render(self, snapshots: dict) -> list:
+        """
+        snapshots — label -> снимок другого процесса (см. snapshot);
+        его серии выводим с дополнительной меткой worker=label.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._children.items():
+            lines.extend(self._render_child(self.labelnames, values, child))
+        labelnames = ("worker",) + self.labelnames
+        for label, snapshot in snapshots.items():
+            for values, data in snapshot.get(self.name, ()):
+                child = self._load_child(data)
+                lines.extend(self._render_child(labelnames, (label, *values), child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+    def _dump_child(self, child):
+        return child.value
+
+    def _load_child(self, data):
+        child = _CounterChild()
+        child.value = data
+        return child
+
+    def _render_child(self, labelnames, values, child):
+        return [f"{self.name}{_format_labels(labelnames, values)} {_format_value(child.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def _dump_child(self, child):
+        return [child.counts, child.sum, child.count]
+
+    def _load_child(self, data):
+        child = _HistogramChild(self.buckets)
+        child.counts, child.sum, child.count = data
+        return child
+
+    def _render_child(self, labelnames, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+        labels = _format_labels(labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Значение читается функцией в момент скрейпа: set_function(fn, *label_values).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._children.clear()  # серии появляются только через set_function
+
+    def _new_child(self):
+        return None
+
+    def set_function(self, fn, *values):
+        self._children[tuple(str(v) for v in values)] = fn
+
+    def dump(self) -> list:
+        # в снимок — уже прочитанные значения: функции в другой процесс не передать
+        series = []
+        for values, fn in self._children.items():
+            try:
+                series.append([list(values), fn()])
+            except Exception:
+                pass
+        return series
+
+    def _load_child(self, data):
+        return lambda: data
+
+    def _render_child(self, labelnames, values, fn):
+        try:
+            value = fn()
+        except Exception:
+            return []
+        return [f"{self.name}{_format_labels(labelnames, values)} {_format_value(value)}"]
+
+
+# ────────────────────────────────
+# Метрики бота
+# ────────────────────────────────
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Время работы хэндлера aiogram", ("handler",)
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения в хэндлерах", ("handler",)
+)
+DB_SECONDS = Histogram(
+    "bot_db_seconds", "Время выполнения функции app/db.py в потоке БД", ("function",)
+)
+REMINDER_LAG = Histogram(
+    "bot_reminder_lag_seconds",
+    "Насколько позже запланированного времени напоминание ушло в отправку",
+    buckets=LAG_BUCKETS,
+)
+OUTBOUND_SECONDS = Histogram(
+    "bot_outbound_seconds", "Длительность вызовов Telegram API из очереди исходящих"
+)
+OUTBOUND_ERRORS = Counter(
+    "bot_outbound_errors_total", "Ошибки вызовов Telegram API", ("kind",)
+)
+PENDING = Gauge(
+    "bot_pending", "Сколько работы ждёт в очередях процесса", ("queue",)
+)
+
+
+def render(snapshots: dict | None = None) -> str:
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render(snapshots or {}))
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request: web.Request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+# ────────────────────────────────
+# Снимки между процессами
+# ────────────────────────────────
+def snapshot() -> dict:
+    """
+    Все серии процесса: имя метрики -> [[значения меток, данные], ...].
+    """
+    return {metric.name: metric.dump() for metric in _REGISTRY}
+
+
+def write_snapshot(directory: str, label: str):
+    """
+    Сохранить снимок процесса в directory/<label>.json. Через временный
+    файл и os.replace — фронт никогда не прочитает файл наполовину.
+    """
+    path = os.path.join(directory, f"{label}.json")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp, path)
+
+
+def read_snapshots(directory: str) -> dict:
+    """
+    label -> снимок для всех процессов, уже записавших его в directory.
+    """
+    snapshots = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                snapshots[name[: -len(".json")]] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def snapshots_handler(directory: str):
+    """
+    Обработчик /metrics для фронта: свои серии плюс снимки воркеров.
+    """
+
+    async def handle(request: web.Request):
+        text = render(read_snapshots(directory))
+        return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+    return handle
+
+
+# ────────────────────────────────
+# Подключение к диспетчеру
+# ────────────────────────────────
+def _timed_handler(handler):
+    timer = HANDLER_SECONDS.labels(handler.__name__)
+    errors = HANDLER_ERRORS.labels(handler.__name__)
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            timer.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+def instrument_handlers(dp):
+    """
+    Обернуть все уже зарегистрированные хэндлеры сообщений и колбэков таймером.
+    Сигнатуры aiogram разобрал при регистрации, так что обёртка ему не мешает.
+    """
+    for observer in (dp.message_handlers, dp.callback_query_handlers):
+        for handler_obj in observer.handlers:
+            handler_obj.handler = _timed_handler(handler_obj.handler)
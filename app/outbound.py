@@ -0,0 +1,319 @@
+# app/outbound.py
+"""
+Очередь исходящих сообщений в Telegram.
+
+Все отправки (ответы хэндлеров и напоминания) идут через OutboundQueue:
+- общий token bucket на бота (~30 сообщений в секунду),
+- свой token bucket на каждый чат (группы ~20 в минуту, личка ~1 в секунду),
+- RetryAfter (429) откладывает только свой чат на указанное время,
+- сетевые ошибки повторяем с экспоненциальной паузой,
+- в одном чате сообщения уходят строго по очереди.
+Глубину очереди видно через depth / stats().
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+from aiogram.utils.exceptions import NetworkError, RestartingTelegram, RetryAfter
+from aiohttp import ClientError
+
+from app.metrics import OUTBOUND_ERRORS, OUTBOUND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых имеет смысл повторить отправку
+RETRYABLE_ERRORS = (NetworkError, RestartingTelegram, ClientError, asyncio.TimeoutError)
+
+_RETRY_AFTER_ERRORS = OUTBOUND_ERRORS.labels("retry_after")
+_NETWORK_ERRORS = OUTBOUND_ERRORS.labels("network")
+_OTHER_ERRORS = OUTBOUND_ERRORS.labels("other")
+
+
+class TokenBucket:
+    """
+    rate — токенов в секунду, capacity — сколько можно отправить «залпом».
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """
+        Через сколько секунд будет доступен один токен (0 — уже есть).
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Item:
+    __slots__ = ("factory", "future", "attempts")
+
+    def __init__(self, factory, future):
+        self.factory = factory
+        self.future = future
+        self.attempts = 0
+
+
+class OutboundQueue:
+    """
+    global_rate — сообщений в секунду на всего бота,
+    group_rate_per_min — сообщений в минуту в одну группу,
+    private_rate — сообщений в секунду в один личный чат,
+    max_concurrency — сколько запросов к API одновременно в полёте,
+    max_attempts — сколько раз пытаемся отправить при сетевых ошибках,
+    warn_depth — с какой глубины очереди пишем предупреждение в лог.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        group_rate_per_min: float = 20,
+        private_rate: float = 1,
+        max_concurrency: int = 20,
+        max_attempts: int = 5,
+        warn_depth: int = 500,
+    ):
+        self.global_rate = global_rate
+        self.group_rate = group_rate_per_min / 60
+        self.group_capacity = group_rate_per_min
+        self.private_rate = private_rate
+        self.max_attempts = max_attempts
+        self.warn_depth = warn_depth
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: dict = {}     # chat_id -> TokenBucket
+        self._chats: dict = {}       # chat_id -> deque[_Item]
+        self._ready: list = []       # (ready_at, seq, chat_id) — чаты, готовые к отправке
+        self._seq = itertools.count()
+        self._depth = 0
+        self._in_flight = 0
+        self._sent = 0
+        self._retries = 0
+        self._failures = 0
+        self._warned = False
+
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._sending: set = set()
+
+    # ────────────────────────────────
+    # Публичный интерфейс
+    # ────────────────────────────────
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # запросы в полёте отменяем и дожидаемся: иначе _send доработает
+        # после очистки очередей и полезет в удалённую self._chats[chat_id]
+        sending = list(self._sending)
+        for task in sending:
+            task.cancel()
+        await asyncio.gather(*sending, return_exceptions=True)
+        for items in self._chats.values():
+            for item in items:
+                if not item.future.done():
+                    item.future.cancel()
+        self._chats.clear()
+        self._ready.clear()
+        self._depth = 0
+
+    def send(self, chat_id: int, factory) -> asyncio.Future:
+        """
+        Поставить в очередь вызов API для чата.
+        factory — функция без аргументов, возвращающая корутину запроса.
+        Возвращает future с результатом (или исключением) запроса.
+        """
+        future = asyncio.get_running_loop().create_future()
+        items = self._chats.get(chat_id)
+        if items is None:
+            items = self._chats[chat_id] = deque()
+            self._push_chat(chat_id, time.monotonic())
+        items.append(_Item(factory, future))
+
+        self._depth += 1
+        if self._depth >= self.warn_depth and not self._warned:
+            self._warned = True
+            logger.warning("Очередь исходящих растёт: %s сообщений ждут отправки", self._depth)
+        return future
+
+    def send_message(self, chat_id: int, text: str, bot=None, **kwargs) -> asyncio.Future:
+        from aiogram import Bot  # локальный импорт: нужен только без явного bot
+
+        bot = bot or Bot.get_current()
+        return self.send(chat_id, lambda: bot.send_message(chat_id, text, **kwargs))
+
+    def answer(self, message, text: str, **kwargs) -> asyncio.Future:
+        """
+        Аналог message.answer(...), но через очередь.
+        """
+        return self.send(message.chat.id, lambda: message.answer(text, **kwargs))
+
+    def edit_text(self, message, text: str, **kwargs) -> asyncio.Future:
+        return self.send(message.chat.id, lambda: message.edit_text(text, **kwargs))
+
+    @property
+    def depth(self) -> int:
+        """
+        Сколько сообщений ждут отправки (без уже отправляемых).
+        """
+        return self._depth
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._depth,
+            "in_flight": self._in_flight,
+            "chats_waiting": len(self._chats),
+            "sent": self._sent,
+            "retries": self._retries,
+            "failures": self._failures,
+        }
+
+    # ────────────────────────────────
+    # Внутренности
+    # ────────────────────────────────
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_capacity)
+            else:
+                bucket = TokenBucket(self.private_rate, max(1, self.private_rate))
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _push_chat(self, chat_id: int, ready_at: float):
+        heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if self._sem.locked():
+                # все слоты заняты — ждём, пока освободится хотя бы один
+                await self._sem.acquire()
+                self._sem.release()
+                continue
+
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            ready_at, _, chat_id = self._ready[0]
+            wait = max(ready_at - now, self._bucket(chat_id).delay(now))
+            if wait > 0:
+                # чат ещё не готов: откладываем его и смотрим на следующие
+                heapq.heapreplace(self._ready, (now + wait, next(self._seq), chat_id))
+                if self._ready[0][0] > now:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self._ready[0][0] - now)
+                    except asyncio.TimeoutError:
+                        pass
+                continue
+
+            global_wait = self._global.delay(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            await self._sem.acquire()  # свободный слот есть, не блокирует
+            heapq.heappop(self._ready)
+            item = self._chats[chat_id].popleft()
+            self._depth -= 1
+            now = time.monotonic()
+            self._global.take(now)
+            self._bucket(chat_id).take(now)
+
+            task = asyncio.create_task(self._send(chat_id, item))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id: int, item: _Item):
+        self._in_flight += 1
+        retry_in = None
+        started = time.perf_counter()
+        try:
+            item.attempts += 1
+            result = await item.factory()
+        except asyncio.CancelledError:
+            item.future.cancel()
+            raise
+        except RetryAfter as e:
+            _RETRY_AFTER_ERRORS.inc()
+            retry_in = e.timeout
+            logger.warning("RetryAfter в чате %s: ждём %s с", chat_id, e.timeout)
+        except RETRYABLE_ERRORS as e:
+            _NETWORK_ERRORS.inc()
+            if item.attempts < self.max_attempts:
+                retry_in = min(2 ** item.attempts, 60)
+                logger.warning(
+                    "Ошибка отправки в чат %s (попытка %s): %s", chat_id, item.attempts, e
+                )
+            else:
+                self._fail(item, e)
+        except Exception as e:
+            _OTHER_ERRORS.inc()
+            self._fail(item, e)
+        else:
+            self._sent += 1
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            OUTBOUND_SECONDS.observe(time.perf_counter() - started)
+            self._in_flight -= 1
+            self._sem.release()
+
+        now = time.monotonic()
+        items = self._chats[chat_id]
+        if retry_in is not None:
+            # повтор встаёт в начало очереди чата — порядок сообщений сохраняется
+            self._retries += 1
+            items.appendleft(item)
+            self._depth += 1
+            self._push_chat(chat_id, now + retry_in)
+        elif items:
+            self._push_chat(chat_id, now)
+        else:
+            del self._chats[chat_id]
+            if self._bucket(chat_id).is_full(now):
+                del self._buckets[chat_id]
+
+        if self._depth < self.warn_depth // 2:
+            self._warned = False
+
+    def _fail(self, item: _Item, error: Exception):
+        self._failures += 1
+        if not item.future.done():
+            item.future.set_exception(error)
@@ -0,0 +1,113 @@
+# app/parser.py
+"""
+Разбор задачи, набранной одной строкой: «Название 28.10.2025 14:30».
+
+inline_task_anywhere вызывается на каждое текстовое сообщение в группах,
+а задачи среди них — редкость. Поэтому сначала дешёвая проверка без
+регулярок и исключений (looks_like_task), и только потом разбор хвоста
+строки одной заранее скомпилированной регуляркой.
+
+Понимаем в конце строки:
+- 28.10.2025 14:30 и 28.10.25 14:30
+- 28.10 14:30 (год — текущий, а если дата уже прошла — следующий)
+- сегодня 14:30, завтра 10:00, послезавтра 9:00
+Время — во всех вариантах parse_time_hhmm: 14:30, 14.30, 14-30, 1430, 930.
+
+strict=True — для сообщений, которые никто не просил считать задачей
+(inline_task_anywhere): только время через двоеточие и только полная
+дата с годом или слово-день. Иначе «Итого за 1.5 1000» или «версия 2.7 300»
+превращаются в задачи.
+"""
+import re
+from datetime import date, datetime, timedelta
+
+from app.db import MOSCOW_TZ
+from app.utils import parse_time_hhmm
+
+# Самая короткая строка с задачей: «Х 1.1 930»
+MIN_TASK_LEN = 9
+
+# Дата и время занимают не больше стольких символов в конце строки
+# («послезавтра 14:30» с пробелом перед ним)
+_TAIL_LEN = 24
+
+_TASK_TAIL = re.compile(
+    r"""
+    \s
+    (?:
+        (?P<day>\d{1,2})\.(?P<month>\d{1,2})(?:\.(?P<year>\d{4}|\d{2}))?
+      | (?P<word>сегодня|завтра|послезавтра)
+    )
+    \s+
+    (?P<time>\d{1,2}[:.\-]\d{2}|\d{3,4})
+    $
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+
+_DAY_WORDS = {"сегодня": 0, "завтра": 1, "послезавтра": 2}
+
+
+def looks_like_task(text: str) -> bool:
+    """
+    Быстрый отсев: в конце строки с задачей всегда стоят две цифры минут.
+    Обычные сообщения чата заканчиваются буквами, знаками или эмодзи.
+    """
+    return len(text) >= MIN_TASK_LEN and text[-1].isdigit() and text[-2].isdigit()
+
+
+def parse_task_line(text: str, now: datetime | None = None, strict: bool = False):
+    """
+    Разобрать строку «Название <дата> <время>».
+    strict — только «ДД.ММ.ГГГГ ЧЧ:ММ» и «завтра ЧЧ:ММ» (см. описание модуля).
+
+    Возвращает (title, deadline) с наивным deadline по Москве
+    или None, если в конце строки нет даты и времени.
+    title может быть пустым — тогда перед датой ничего не написали.
+    """
+    text = text.strip()
+    if not looks_like_task(text):
+        return None
+
+    tail = text[-_TAIL_LEN:]
+    # пробел перед датой нужен регулярке, даже если названия нет
+    if len(text) <= _TAIL_LEN:
+        tail = " " + tail
+    offset = len(text) - len(tail)  # где хвост начинается в text
+    match = _TASK_TAIL.search(tail)
+    if match is None:
+        return None
+    if strict and (
+        ":" not in match.group("time")
+        or (match.group("word") is None and match.group("year") is None)
+    ):
+        return None
+
+    hm = parse_time_hhmm(match.group("time"))
+    if hm is None:
+        return None
+    hour, minute = hm
+
+    today = (now or datetime.now(MOSCOW_TZ)).date()
+    word = match.group("word")
+    try:
+        if word is not None:
+            day = today + timedelta(days=_DAY_WORDS[word.lower()])
+        else:
+            year = match.group("year")
+            if year is None:
+                day = date(today.year, int(match.group("month")), int(match.group("day")))
+                if day < today:
+                    day = day.replace(year=today.year + 1)
+            else:
+                year = int(year)
+                if year < 100:
+                    year += 2000
+                day = date(year, int(match.group("month")), int(match.group("day")))
+        deadline = datetime(day.year, day.month, day.day, hour, minute)
+    except ValueError:
+        # 31.02, 25:00 и прочие невозможные даты
+        return None
+
+    title = text[: max(offset + match.start(), 0)].strip()
+    return title, deadline
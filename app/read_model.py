@@ -0,0 +1,153 @@
+# app/read_model.py
+"""
+Модель чтения: активные задачи в памяти процесса.
+
+Чтения у бота на порядок чаще записей: список задач, листание, проверка
+задачи в /close и /undo. Держим все активные задачи процесса в памяти
+и отвечаем на такие чтения без SQLite и без потока БД:
+- TaskRecord на __slots__ вместо dict из _dict_factory — только поля,
+  нужные для чтения, отметки — кортежем user_id;
+- для каждого чата — отсортированный список ключей (deadline_at, id),
+  страница находится bisect'ом за O(log n).
+
+Загружается один раз на старте (db.load_read_model), дальше её обновляют
+сами функции записи app/db.py после commit. Обновления идут из потока БД,
+читает event loop: каждое изменение — одна операция над list/dict/атрибутом
+(атомарна под GIL), а отметки — неизменяемый кортеж, который заменяется целиком.
+
+Напоминания её не читают: в режиме воркеров их отправляет тот процесс,
+у которого аренда, а задачи чатов меняются в других процессах.
+"""
+import bisect
+
+
+class TaskRecord:
+    __slots__ = ("id", "chat_id", "title", "deadline_at", "completers")
+
+    def __init__(self, id: int, chat_id: int, title: str, deadline_at: int, completers: tuple = ()):
+        self.id = id
+        self.chat_id = chat_id
+        self.title = title
+        self.deadline_at = deadline_at
+        self.completers = completers
+
+    @property
+    def key(self) -> tuple:
+        return (self.deadline_at, self.id)
+
+
+class ActiveTasks:
+    """
+    task_id -> TaskRecord и chat_id -> отсортированные ключи (deadline_at, id).
+
+    shard=(index, workers) — держать только чаты своего воркера
+    (chat_id % workers == index, как раскладывает апдейты app/workers.py).
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.shard: tuple | None = None
+        self._by_id: dict = {}
+        self._by_chat: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def owns(self, chat_id: int) -> bool:
+        return self.shard is None or chat_id % self.shard[1] == self.shard[0]
+
+    # ────────────────────────────────
+    # Загрузка и обновления (поток БД)
+    # ────────────────────────────────
+    def load(self, tasks, completions, shard: tuple | None = None):
+        """
+        tasks — (id, chat_id, title, deadline_at), completions — (task_id, user_id)
+        в порядке отметок. Собираем новые структуры и подменяем разом.
+        """
+        self.shard = shard
+        by_id = {}
+        by_chat = {}
+        chat_ids = {}  # один объект int на чат, а не на каждую его задачу
+        for task_id, chat_id, title, deadline_at in tasks:
+            if not self.owns(chat_id):
+                continue
+            chat_id = chat_ids.setdefault(chat_id, chat_id)
+            by_id[task_id] = TaskRecord(task_id, chat_id, title, deadline_at)
+            by_chat.setdefault(chat_id, []).append((deadline_at, task_id))
+
+        completers = {}
+        for task_id, user_id in completions:
+            if task_id in by_id:
+                completers.setdefault(task_id, []).append(user_id)
+        for task_id, user_ids in completers.items():
+            by_id[task_id].completers = tuple(user_ids)
+
+        for keys in by_chat.values():
+            keys.sort()
+        self._by_id, self._by_chat = by_id, by_chat
+        self.loaded = True
+
+    def add(self, record: TaskRecord):
+        if not self.loaded or not self.owns(record.chat_id):
+            return
+        self.remove(record.id)
+        self._by_id[record.id] = record
+        bisect.insort(self._by_chat.setdefault(record.chat_id, []), record.key)
+
+    def remove(self, task_id: int):
+        record = self._by_id.pop(task_id, None)
+        if record is None:
+            return
+        keys = self._by_chat.get(record.chat_id)
+        if keys is None:
+            return
+        i = bisect.bisect_left(keys, record.key)
+        if i < len(keys) and keys[i] == record.key:
+            del keys[i]
+        if not keys:
+            self._by_chat.pop(record.chat_id, None)
+
+    def add_completer(self, task_id: int, user_id: int):
+        record = self._by_id.get(task_id)
+        if record is not None and user_id not in record.completers:
+            record.completers = record.completers + (user_id,)
+
+    def remove_completer(self, task_id: int, user_id: int):
+        record = self._by_id.get(task_id)
+        if record is not None:
+            record.completers = tuple(u for u in record.completers if u != user_id)
+
+    # ────────────────────────────────
+    # Чтение (event loop)
+    # ────────────────────────────────
+    def get(self, task_id: int) -> TaskRecord | None:
+        return self._by_id.get(task_id)
+
+    def page(self, chat_id: int, limit: int, after=None, before=None):
+        """
+        Та же страница, что db.get_tasks_page, но из памяти:
+        (список TaskRecord по возрастанию дедлайна, has_more).
+        """
+        keys = self._by_chat.get(chat_id)
+        if not keys:
+            return [], False
+
+        if before is not None:
+            end = bisect.bisect_left(keys, tuple(before))
+            begin = max(end - limit, 0)
+            has_more = begin > 0
+        else:
+            begin = 0 if after is None else bisect.bisect_right(keys, tuple(after))
+            end = begin + limit
+            has_more = end < len(keys)
+
+        by_id = self._by_id
+        tasks = []
+        for _, task_id in keys[begin:end]:
+            record = by_id.get(task_id)
+            if record is not None:
+                tasks.append(record)
+        return tasks, has_more
+
+
+ACTIVE = ActiveTasks()
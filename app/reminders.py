@@ -0,0 +1,437 @@
+# app/reminders.py
+"""
+Напоминания о дедлайнах.
+
+Напоминания хранятся в таблице reminders (due_at, task_id, offset_days, state),
+а отправляет их один цикл ReminderEngine: спит до ближайшего due_at,
+забирает наступившие напоминания пачками и рассылает.
+
+В памяти держим только «окно» — напоминания на ближайшие horizon секунд.
+Окно подгружается в фоне диапазонным запросом по индексу и постепенно
+сдвигается вперёд, так что старт не ждёт загрузки всей таблицы,
+а расход памяти не зависит от общего числа задач.
+"""
+import asyncio
+import heapq
+import logging
+import time as _time
+from datetime import datetime, timedelta, time
+
+from app import db_async
+from app.db import MOSCOW_TZ
+from app.metrics import REMINDER_LAG
+
+logger = logging.getLogger(__name__)
+
+# За сколько дней до дедлайна напоминаем
+REMINDER_OFFSETS = (3, 1, 0)
+
+REMINDER_TEXTS = {
+    3: "⏳ Напоминание: через пару дней дедлайн по задаче: «{title}»",
+    1: "⚡ Напоминание: завтра дедлайн по задаче: «{title}»",
+    0: "🔥 Сегодня дедлайн по задаче: «{title}»",
+}
+
+# Строки сводки, когда в чате наступило сразу несколько напоминаний
+REMINDER_DIGEST_LINES = {
+    3: "⏳ Через пару дней: «{title}»",
+    1: "⚡ Завтра: «{title}»",
+    0: "🔥 Сегодня: «{title}»",
+}
+
+
+# ────────────────────────────────
+# Вспомогательные функции для напоминаний
+# ────────────────────────────────
+def _shift_to_work_morning(date_obj):
+    """
+    Берём datetime в московской таймзоне.
+    Если это суббота/воскресенье — сдвигаем на ближайший понедельник,
+    сохраняя время (часы и минуты).
+    """
+    from datetime import date as _date, datetime as _dt
+
+    # приводим вход в нормальный datetime
+    if isinstance(date_obj, _date) and not isinstance(date_obj, _dt):
+        # если вдруг пришла просто дата — оставим время 09:00
+        date_obj = _dt.combine(date_obj, time(9, 0))
+    elif not isinstance(date_obj, _dt):
+        date_obj = _dt.fromisoformat(str(date_obj))
+
+    # навешиваем московскую таймзону
+    if date_obj.tzinfo is None:
+        date_obj = date_obj.replace(tzinfo=MOSCOW_TZ)
+    else:
+        date_obj = date_obj.astimezone(MOSCOW_TZ)
+
+    # 5 = суббота, 6 = воскресенье
+    while date_obj.weekday() >= 5:
+        date_obj += timedelta(days=1)
+
+    return date_obj
+
+
+def reminder_due_times(deadline, now: datetime | None = None):
+    """
+    Когда напоминать о задаче: список (offset_days, due_at) только в будущем.
+
+    - за 3 дня до дедлайна (в то же время, что и дедлайн)
+    - за 1 день до дедлайна
+    - в день дедлайна
+    Если дата попадает на выходной (сб/вс) — переносим на ближайший понедельник,
+    но время оставляем тем же.
+    """
+    # приводим дедлайн к datetime в часовом поясе Москвы
+    if isinstance(deadline, str):
+        deadline_dt = datetime.fromisoformat(deadline)
+    else:
+        deadline_dt = deadline
+
+    if deadline_dt.tzinfo is None:
+        # считаем, что дедлайн задан по Москве
+        deadline_dt = deadline_dt.replace(tzinfo=MOSCOW_TZ)
+    else:
+        # приводим к Москве
+        deadline_dt = deadline_dt.astimezone(MOSCOW_TZ)
+
+    now_moscow = now or datetime.now(MOSCOW_TZ)
+
+    result = []
+    for offset in REMINDER_OFFSETS:
+        # datetime, относительно которого шлём напоминание (то же время, что дедлайн)
+        remind_dt = deadline_dt - timedelta(days=offset)
+
+        # приводим к рабочему дню, но сохраняем время
+        remind_dt = _shift_to_work_morning(remind_dt)
+
+        # если это время уже прошло — не планируем
+        if remind_dt <= now_moscow:
+            continue
+
+        result.append((offset, int(remind_dt.timestamp())))
+    return result
+
+
+async def schedule_task_reminders(engine, task_id: int, chat_id: int, deadline):
+    """
+    Записать будущие напоминания по задаче в БД и положить в окно движка
+    те из них, что наступают в пределах горизонта.
+    Для вернувшейся в работу задачи (undo закрытия) заново взводит
+    её отменённые напоминания, которые ещё впереди.
+    """
+    try:
+        due_times = reminder_due_times(deadline)
+    except ValueError:
+        return
+    if not due_times:
+        return
+
+    pending = await db_async.add_reminders(task_id, chat_id, due_times)
+    engine.add(pending)
+
+
+async def cancel_task_reminders(engine, task_id: int):
+    """
+    Задачу закрыли — отменяем её напоминания в БД и выкидываем из окна движка.
+    """
+    await db_async.cancel_task_reminders(task_id)
+    engine.cancel(task_id)
+
+
+def reminder_text(items: list) -> str:
+    """
+    Текст напоминания для одного чата: items — список (offset_days, title).
+    Одно напоминание — обычный текст, несколько — одна сводка.
+    """
+    if len(items) == 1:
+        offset, title = items[0]
+        return REMINDER_TEXTS[offset].format(title=title)
+
+    # сначала самые горящие
+    lines = [
+        REMINDER_DIGEST_LINES[offset].format(title=title)
+        for offset, title in sorted(items, key=lambda item: item[0])
+    ]
+    return "🔔 Напоминания по дедлайнам:\n\n" + "\n".join(lines)
+
+
+# ────────────────────────────────
+# Цикл отправки напоминаний
+# ────────────────────────────────
+class ReminderEngine:
+    """
+    Один фоновый цикл вместо отдельной джобы на каждое напоминание.
+
+    horizon — на сколько секунд вперёд держим напоминания в памяти,
+    refill_every — как часто сдвигаем окно вперёд (и подбираем из БД
+    просроченные напоминания, которые в окно не попали),
+    batch_size — сколько напоминаний забираем из БД за раз,
+    coalesce_window — напоминания одного чата, наступающие в пределах
+    стольких секунд, уходят одним сообщением-сводкой (чуть раньше срока),
+    grace — напоминания, опоздавшие сильнее (бот лежал), не отправляем вовсе,
+    retry_after / max_attempts — не доставленное напоминание повторяем через
+    столько секунд, но не больше max_attempts раз, потом оно 'failed',
+    poll_every — как часто (секунды) проверять, не завели ли напоминания
+    внутри окна другие процессы (0 — не проверять: в одном процессе
+    новые напоминания и так попадают в окно через add()).
+    """
+
+    def __init__(
+        self,
+        bot,
+        outbound,
+        horizon: int = 6 * 3600,
+        refill_every: int = 300,
+        batch_size: int = 200,
+        coalesce_window: int = 60,
+        grace: int = 3600,
+        retry_after: int = 60,
+        max_attempts: int = 5,
+        poll_every: int = 0,
+        claim_timeout: int = 600,
+    ):
+        self.bot = bot
+        self.outbound = outbound
+        self.horizon = horizon
+        self.refill_every = refill_every
+        self.batch_size = batch_size
+        self.coalesce_window = coalesce_window
+        self.grace = grace
+        self.retry_after = retry_after
+        self.max_attempts = max_attempts
+        self.poll_every = poll_every
+        self.claim_timeout = claim_timeout
+
+        self._reset()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def _reset(self):
+        self._heap: list = []       # (due_at, reminder_id)
+        self._window: dict = {}     # reminder_id -> (due_at, task_id)
+        self._by_task: dict = {}    # task_id -> {reminder_id, ...}
+        self._horizon_end = 0       # до какого due_at окно уже загружено
+        self._next_refill = 0
+        self._next_poll = 0
+        self._last_id = None        # последний увиденный reminders.id (для poll_every)
+        self._sleep_until = 0
+
+    def start(self):
+        """
+        Запустить цикл. Окно грузится уже внутри цикла, поэтому старт
+        мгновенный и вебхук можно ставить сразу.
+
+        Окно собираем заново: после потери и нового захвата аренды старое
+        устарело — напоминания за это время отправлял и заводил другой воркер.
+        """
+        self._reset()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @property
+    def window_size(self) -> int:
+        return len(self._window)
+
+    def add(self, reminders: list):
+        """
+        Новые напоминания (id, task_id, due_at): в окно кладём только те, что
+        в пределах горизонта, остальные подтянет очередной refill.
+        """
+        earliest = None
+        for reminder_id, task_id, due_at in reminders:
+            if due_at > self._horizon_end or reminder_id in self._window:
+                continue
+            self._window[reminder_id] = (due_at, task_id)
+            self._by_task.setdefault(task_id, set()).add(reminder_id)
+            heapq.heappush(self._heap, (due_at, reminder_id))
+            if earliest is None or due_at < earliest:
+                earliest = due_at
+
+        if earliest is not None and earliest < self._sleep_until:
+            self._wakeup.set()
+
+    def cancel(self, task_id: int):
+        """
+        Убрать из окна все напоминания задачи. Записи в куче остаются
+        и просто пропускаются, когда до них дойдёт очередь.
+        """
+        for reminder_id in self._by_task.pop(task_id, ()):
+            self._window.pop(reminder_id, None)
+
+    def _forget(self, reminder_id: int) -> bool:
+        entry = self._window.pop(reminder_id, None)
+        if entry is None:
+            return False
+        task_id = entry[1]
+        ids = self._by_task.get(task_id)
+        if ids is not None:
+            ids.discard(reminder_id)
+            if not ids:
+                del self._by_task[task_id]
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка в цикле напоминаний")
+                await asyncio.sleep(1)
+
+    async def _tick(self):
+        now = int(_time.time())
+        if now >= self._next_refill:
+            await self._refill(now)
+        if self.poll_every and now >= self._next_poll:
+            await self._poll(now)
+
+        due_ids = []
+        # как только что-то наступило — забираем и всё, что наступит в ближайшие
+        # coalesce_window секунд, чтобы отправить сводкой, а не россыпью
+        if self._heap and self._heap[0][0] <= now:
+            until = now + self.coalesce_window
+        else:
+            until = now
+        while self._heap and self._heap[0][0] <= until and len(due_ids) < self.batch_size:
+            _, reminder_id = heapq.heappop(self._heap)
+            if self._forget(reminder_id):
+                due_ids.append(reminder_id)
+
+        if due_ids:
+            batch = await db_async.claim_reminders(due_ids, now)
+            if batch:
+                await self._dispatch(batch)
+            return
+
+        # сначала сбрасываем событие, потом считаем время сна — чтобы не потерять add()
+        self._wakeup.clear()
+        next_due = self._heap[0][0] if self._heap else self._next_refill
+        self._sleep_until = min(next_due, self._next_refill)
+        if self.poll_every:
+            self._sleep_until = min(self._sleep_until, self._next_poll)
+
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), max(self._sleep_until - now, 0))
+        except asyncio.TimeoutError:
+            pass
+
+    async def _refill(self, now: int):
+        """
+        Сдвинуть окно до now + horizon и подобрать просроченные напоминания,
+        которых в окне нет (добавлены другим процессом или возвращены после сбоя).
+        Зависшие дольше claim_timeout claim возвращаем в очередь,
+        безнадёжно опоздавшие сначала помечаем пропущенными.
+        """
+        released = await db_async.release_claimed_reminders(now - self.claim_timeout)
+        if released:
+            logger.warning("Вернули в очередь зависших напоминаний: %s", released)
+
+        missed = await db_async.skip_missed_reminders(now, self.grace)
+        if missed:
+            logger.info("Пропущено опоздавших напоминаний: %s", missed)
+
+        while True:
+            overdue = await db_async.claim_due_reminders(now, self.batch_size)
+            if not overdue:
+                break
+            await self._dispatch(overdue)
+
+        if self.poll_every and self._last_id is None:
+            # всё, что заведут после этого id, подберёт _poll
+            self._last_id = await db_async.last_reminder_id()
+
+        start, end = self._horizon_end, now + self.horizon
+        # границу двигаем до запроса: add() во время запроса уже положит в окно
+        self._horizon_end = end
+        self._next_refill = now + self.refill_every
+        rows = await db_async.get_pending_reminders_between(start, end)
+        self.add(rows)
+        logger.info(
+            "Окно напоминаний до %s: +%s, всего в памяти %s",
+            datetime.fromtimestamp(end, MOSCOW_TZ).isoformat(),
+            len(rows),
+            self.window_size,
+        )
+
+    async def _poll(self, now: int):
+        """
+        Подобрать напоминания, которые другие процессы завели внутри
+        уже загруженного окна: их add() до этого движка не доходит.
+        """
+        self._next_poll = now + self.poll_every
+        while True:
+            last_id = self._last_id
+            rows, self._last_id = await db_async.get_new_pending_reminders(
+                last_id, self._horizon_end, self.batch_size
+            )
+            self.add(rows)
+            if self._last_id == last_id or self._last_id - last_id < self.batch_size:
+                return
+
+    async def _dispatch(self, batch: list):
+        """
+        Отправить пачку: по одному сообщению на чат, несколько
+        напоминаний одного чата собираем в сводку.
+        """
+        now = _time.time()
+        for reminder in batch:
+            self._forget(reminder["id"])
+            # ушедшие раньше срока в составе сводки считаем без опоздания
+            REMINDER_LAG.observe(max(now - reminder["due_at"], 0))
+
+        # статусы и названия всех задач пачки — одним запросом
+        tasks = await db_async.get_tasks_by_ids(list({r["task_id"] for r in batch}))
+
+        by_chat: dict = {}   # chat_id -> [(offset_days, title)]
+        ids_by_chat: dict = {}
+        done_ids = []        # отправлять нечего (задача закрыта) — тоже считаем обработанными
+        for reminder in batch:
+            task = tasks.get(reminder["task_id"])
+            if (
+                reminder["offset_days"] not in REMINDER_TEXTS
+                or not task
+                or task.get("status") != "active"
+            ):
+                done_ids.append(reminder["id"])
+                continue
+            title = task.get("title", "без названия")
+            by_chat.setdefault(reminder["chat_id"], []).append((reminder["offset_days"], title))
+            ids_by_chat.setdefault(reminder["chat_id"], []).append(reminder["id"])
+
+        chat_ids = list(by_chat)
+        sends = [
+            self.outbound.send_message(chat_id, reminder_text(by_chat[chat_id]), bot=self.bot)
+            for chat_id in chat_ids
+        ]
+
+        # ждём, пока очередь реально доставит пачку (с учётом лимитов и повторов);
+        # 'sent' ставим только доставленным, остальные пойдут на повтор
+        results = await asyncio.gather(*sends, return_exceptions=True)
+        failed_ids = []
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
+                logger.warning(
+                    "Не смогли отправить напоминания в чат %s: %s",
+                    chat_id,
+                    result,
+                )
+                failed_ids.extend(ids_by_chat[chat_id])
+            else:
+                done_ids.extend(ids_by_chat[chat_id])
+
+        if done_ids:
+            await db_async.finish_reminders(done_ids)
+        if failed_ids:
+            retry_at = int(_time.time()) + self.retry_after
+            self.add(await db_async.retry_reminders(failed_ids, retry_at, self.max_attempts))
@@ -0,0 +1,42 @@
+# app/render_cache.py
+"""
+Кэш отрисованных страниц списка задач.
+
+Страница «📋 Мои задачи» — это запрос к БД, имена отметившихся и сборка
+HTML с клавиатурой. Пока в чате ничего не менялось, результат тот же,
+поэтому храним его вместе с версией данных чата (db.chat_version):
+версия совпала — отдаём готовое одним поиском в dict, нет — рисуем заново.
+"""
+from collections import OrderedDict
+
+
+class PageCache:
+    """
+    (chat_id, ...ключ страницы) -> (версия чата, страница).
+
+    maxsize — сколько страниц держим в памяти (LRU).
+    """
+
+    def __init__(self, maxsize: int = 2000):
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, version: int):
+        """
+        Страница, если она отрисована для этой версии данных, иначе None.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: tuple, version: int, page):
+        self._entries[key] = (version, page)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
@@ -0,0 +1,155 @@
+# app/users.py
+"""
+Кэш отображаемых имён пользователей.
+
+Имена нужны, чтобы показать в списке задач, кто отметил выполнение.
+Вместо get_chat на каждого пользователя при каждом нажатии
+«📋 Мои задачи» держим LRU с TTL в памяти, а за ним — таблицу users в БД.
+Кэш пассивно наполняется из from_user входящих сообщений и колбэков,
+так что в обычном случае сеть вообще не нужна.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from app import db_async
+
+logger = logging.getLogger(__name__)
+
+
+def _label(username: str | None, full_name: str) -> str:
+    return f"@{username}" if username else full_name
+
+
+class UserCache:
+    """
+    user_id -> подпись ("@username" или полное имя).
+
+    maxsize — сколько пользователей держим в памяти (LRU),
+    ttl — через сколько секунд запись считаем устаревшей и обновляем,
+    fetch_concurrency — сколько get_chat одновременно на промахах.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: int = 24 * 3600, fetch_concurrency: int = 5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # user_id -> (label, expires_at)
+        self._fetch_sem = asyncio.Semaphore(fetch_concurrency)
+        self._pending_writes: set = set()
+
+    def get(self, user_id: int) -> str | None:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        label, expires_at = entry
+        if expires_at < time.time():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return label
+
+    def _put(self, user_id: int, label: str, updated_at: float):
+        self._entries[user_id] = (label, updated_at + self.ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def remember(self, user: types.User | None):
+        """
+        Запомнить пользователя из входящего апдейта.
+        В БД пишем только новых, изменившихся или устаревших.
+        """
+        if user is None or user.is_bot:
+            return
+        label = _label(user.username, user.full_name)
+        if self.get(user.id) == label:
+            return
+
+        now = int(time.time())
+        self._put(user.id, label, now)
+        self._persist([(user.id, user.username, user.full_name, now)])
+
+    def _persist(self, rows: list):
+        # запись в фоне: хэндлер не ждёт БД ради кэша имён
+        task = asyncio.create_task(db_async.upsert_users(rows))
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    async def resolve(self, bot, user_ids) -> dict:
+        """
+        Подписи для набора user_id: память → таблица users → get_chat
+        (параллельно, не больше fetch_concurrency запросов за раз).
+        """
+        result = {}
+        misses = []
+        for user_id in dict.fromkeys(user_ids):
+            label = self.get(user_id)
+            if label is None:
+                misses.append(user_id)
+            else:
+                result[user_id] = label
+
+        if not misses:
+            return result
+
+        stored = await db_async.get_users(misses)
+        now = time.time()
+        to_fetch = []
+        for user_id in misses:
+            row = stored.get(user_id)
+            if row is None:
+                to_fetch.append(user_id)
+                continue
+            label = _label(row["username"], row["full_name"])
+            result[user_id] = label
+            # даже старую запись показываем: имя меняется редко,
+            # а свежее подтянется из следующего сообщения пользователя
+            self._put(user_id, label, now)
+
+        if to_fetch:
+            fetched = await asyncio.gather(*(self._fetch(bot, uid) for uid in to_fetch))
+            rows = []
+            for user_id, chat in zip(to_fetch, fetched):
+                if chat is None:
+                    result[user_id] = f"ID:{user_id}"
+                    continue
+                label = _label(chat.username, chat.full_name)
+                result[user_id] = label
+                self._put(user_id, label, now)
+                rows.append((user_id, chat.username, chat.full_name, int(now)))
+            if rows:
+                self._persist(rows)
+
+        return result
+
+    async def _fetch(self, bot, user_id: int):
+        async with self._fetch_sem:
+            try:
+                return await bot.get_chat(user_id)
+            except Exception as e:
+                logger.warning(
+                    "Не смогли получить данные пользователя %s: %s",
+                    user_id,
+                    e,
+                )
+                return None
+
+
+class UserCacheMiddleware(BaseMiddleware):
+    """
+    Кладёт автора каждого сообщения и колбэка в UserCache.
+    """
+
+    def __init__(self, cache: UserCache):
+        super().__init__()
+        self.cache = cache
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        self.cache.remember(message.from_user)
+
+    async def on_pre_process_callback_query(self, query: types.CallbackQuery, data: dict):
+        self.cache.remember(query.from_user)
@@ -0,0 +1,257 @@
+# app/workers.py
+"""
+Режим нескольких процессов (WORKERS > 1).
+
+Фронт — лёгкий aiohttp-сервер: принимает вебхук, по chat_id выбирает
+воркера (chat_id % WORKERS) и кладёт сырой апдейт в его очередь.
+Все апдейты одного чата попадают в один процесс и идут по порядку,
+поэтому кэши в памяти (FSM, имена) остаются согласованными.
+
+Каждый воркер — отдельный процесс со своим диспетчером, очередью
+апдейтов (app/ingest.py), очередью исходящих и потоком БД. Цикл напоминаний крутит ровно один из них:
+тот, кто держит аренду "reminders" в общей SQLite (см. ReminderLease).
+
+Метрики воркеры раз в METRICS_SNAPSHOT_SEC секунд сбрасывают в общий
+временный каталог, а /metrics фронта отдаёт их с меткой worker.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing as mp
+import os
+import queue
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+from app import db, db_async, metrics
+from app.ingest import update_chat_id
+from app.main import (
+    METRICS_SNAPSHOT_SEC,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_URL,
+    WORKER_QUEUE_SIZE,
+    create_bot,
+    create_dispatcher,
+    on_shutdown,
+)
+
+logger = logging.getLogger(__name__)
+
+# ────────────────────────────────
+# Аренда цикла напоминаний
+# ────────────────────────────────
+class ReminderLease:
+    """
+    Запускает ReminderEngine, только пока этот процесс держит аренду в БД.
+
+    Владелец продлевает аренду каждые ttl / 3 секунд. Если он умер или завис,
+    через ttl аренду заберёт другой воркер и поднимет напоминания у себя.
+    """
+
+    NAME = "reminders"
+
+    def __init__(self, reminders, owner: str, ttl: float = 30):
+        self.reminders = reminders
+        self.owner = owner
+        self.ttl = ttl
+        self.owned = False
+        self._expires_at = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.owned:
+            await self._lose()
+            # отдаём сразу, чтобы другой воркер не ждал истечения ttl
+            await db_async.release_lease(self.NAME, self.owner)
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                held = await db_async.acquire_lease(self.NAME, self.owner, self.ttl)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Не удалось продлить аренду напоминаний")
+                # не знаем, наша ли ещё аренда: держимся, пока она точно не истекла
+                held = self.owned and time.monotonic() < self._expires_at
+
+            if held:
+                self._expires_at = started + self.ttl
+                if not self.owned:
+                    self.owned = True
+                    self.reminders.start()
+                    logger.info("⏰ %s: напоминания теперь отправляет этот воркер", self.owner)
+            elif self.owned:
+                logger.warning("%s: аренда напоминаний потеряна", self.owner)
+                await self._lose()
+
+            await asyncio.sleep(self.ttl / 3)
+
+    async def _lose(self):
+        self.owned = False
+        await self.reminders.stop()
+
+
+# ────────────────────────────────
+# Воркер
+# ────────────────────────────────
+def worker_main(index: int, updates, workers: int, metrics_dir: str):
+    """
+    Точка входа процесса-воркера.
+    """
+    # Ctrl+C получает вся группа процессов; останавливает воркеров фронт
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_worker(index, updates, workers, metrics_dir))
+
+
+async def _write_metrics(metrics_dir: str, label: str):
+    while True:
+        await asyncio.sleep(METRICS_SNAPSHOT_SEC)
+        try:
+            metrics.write_snapshot(metrics_dir, label)
+        except OSError:
+            logger.exception("Не удалось сохранить снимок метрик")
+
+
+async def _worker(index: int, updates, workers: int, metrics_dir: str):
+    dp = create_dispatcher(workers, index)
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+
+    await db_async.init_db()
+    # в памяти — только чаты этого воркера
+    await db_async.load_read_model(shard=(index, workers))
+    dp["outbound"].start()
+    await dp["ingest"].start()
+
+    lease = ReminderLease(dp["reminders"], owner=f"{socket.gethostname()}:{os.getpid()}")
+    lease.start()
+    if index == 0:
+        # архиву хватит одного процесса
+        dp["archiver"].start()
+    label = str(index)
+    metrics_writer = asyncio.create_task(_write_metrics(metrics_dir, label))
+    logger.info("👷 Воркер %s (pid %s) запущен", index, os.getpid())
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # очередь процессов блокирующая — ждём её в потоке, не в event loop
+            raw = await loop.run_in_executor(None, updates.get)
+            if raw is None:
+                break
+            data = json.loads(raw)
+            # своя очередь полна — не читаем дальше, и фронт упрётся в 503
+            await dp["ingest"].put(update_chat_id(data), types.Update(**data))
+    finally:
+        metrics_writer.cancel()
+        await lease.stop()
+        await on_shutdown(dp)
+        # последний снимок — чтобы счётчики не откатились до прошлого сброса
+        metrics.write_snapshot(metrics_dir, label)
+        logger.info("👷 Воркер %s остановлен", index)
+
+
+# ────────────────────────────────
+# Фронт
+# ────────────────────────────────
+def run_front(workers: int):
+    """
+    Поднять воркеров и принимать вебхук в текущем процессе.
+    """
+    # схему доводим до актуальной один раз, до старта воркеров
+    db.init_db()
+    db.close_db()
+
+    ctx = mp.get_context("spawn")
+    queues = [ctx.Queue(WORKER_QUEUE_SIZE) for _ in range(workers)]
+    metrics_dir = tempfile.mkdtemp(prefix="bot-metrics-")
+    procs = [None] * workers
+
+    def spawn(index: int):
+        proc = ctx.Process(
+            target=worker_main,
+            args=(index, queues[index], workers, metrics_dir),
+            name=f"worker-{index}",
+        )
+        proc.start()
+        procs[index] = proc
+
+    for index in range(workers):
+        spawn(index)
+        metrics.PENDING.set_function(queues[index].qsize, f"worker_{index}")
+
+    async def handle_update(request: web.Request):
+        raw = await request.read()
+        try:
+            update = json.loads(raw)
+        except ValueError:
+            return web.Response(status=400)
+
+        index = update_chat_id(update) % workers
+        try:
+            queues[index].put_nowait(raw)
+        except queue.Full:
+            # воркер не успевает: Telegram повторит доставку позже
+            logger.warning("Очередь воркера %s переполнена", index)
+            return web.Response(status=503)
+        return web.Response()
+
+    async def watch_workers(app: web.Application):
+        while True:
+            await asyncio.sleep(5)
+            for index, proc in enumerate(procs):
+                if not proc.is_alive():
+                    logger.error(
+                        "Воркер %s упал (код %s), перезапускаем", index, proc.exitcode
+                    )
+                    spawn(index)
+
+    async def on_startup(app: web.Application):
+        app["bot"] = create_bot()
+        await app["bot"].set_webhook(WEBHOOK_URL, drop_pending_updates=True)
+        logger.info(f"🌐 Webhook установлен: {WEBHOOK_URL}")
+        app["watchdog"] = asyncio.create_task(watch_workers(app))
+
+    async def on_cleanup(app: web.Application):
+        app["watchdog"].cancel()
+        session = await app["bot"].get_session()
+        await session.close()
+
+        for updates in queues:
+            updates.put(None)
+        loop = asyncio.get_running_loop()
+        for proc in procs:
+            await loop.run_in_executor(None, proc.join, 30)
+            if proc.is_alive():
+                logger.warning("Воркер %s не остановился, завершаем принудительно", proc.name)
+                proc.terminate()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    # очереди к воркерам — свои, остальное — из снимков воркеров
+    app.router.add_get("/metrics", metrics.snapshots_handler(metrics_dir))
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT)
@@ -0,0 +1,110 @@
+# bench/bench_parser.py
+"""
+Микробенчмарк разбора однострочных задач на потоке сообщений группового чата.
+
+Сравниваем старый способ (text[-16:] + datetime.strptime на каждое сообщение)
+с app.parser.parse_task_line — в строгом режиме, как его зовёт
+inline_task_anywhere на каждом сообщении группы, и в обычном, как в /add. Корпус — типичная переписка: короткие реплики,
+вопросы, ссылки, эмодзи, числа и время «в 15:00», среди которых ~3% задач.
+
+Запуск из корня проекта:
+    python -m bench.bench_parser [--messages 200000] [--repeat 5]
+"""
+import argparse
+import functools
+import random
+import time
+from datetime import datetime
+
+from app.parser import parse_task_line
+
+CHATTER = [
+    "всем привет",
+    "ок",
+    "да, согласна 👍",
+    "кто сегодня на созвоне?",
+    "скинь, пожалуйста, ссылку на таблицу",
+    "https://docs.google.com/spreadsheets/d/1AbCdEf/edit#gid=0",
+    "созвон переносится на 15:00",
+    "я буду в 14:30",
+    "в 2025 году было 1200 заявок",
+    "Спасибо!!!",
+    "😂😂😂",
+    "посмотрю вечером и отпишусь",
+    "номер заказа 4815162342",
+    "отчёт за 10.2025 уже в папке",
+    "договорились на 28.10",
+    "коллеги, напоминаю про дедлайн по макетам",
+    "а где лежит презентация для клиента?",
+    "+1",
+    "сейчас гляну",
+    "обед в 13.00?",
+    "Я пока не успеваю, давайте завтра",
+    "цена 1 500 руб, скидка 10%",
+]
+
+TASKS = [
+    "Сделать отчёт 28.10.2025 14:30",
+    "Подготовить презентацию 05.11 10:00",
+    "Позвонить подрядчику завтра 11:00",
+    "Согласовать бюджет сегодня 1800",
+    "Отправить договор 3.12.25 9:30",
+]
+
+
+def make_corpus(size: int, task_share: float = 0.03, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    return [
+        rnd.choice(TASKS) if rnd.random() < task_share else rnd.choice(CHATTER)
+        for _ in range(size)
+    ]
+
+
+def old_parse(text: str):
+    """
+    Прежняя логика inline_task_anywhere.
+    """
+    text = text.strip()
+    if len(text) < 17:
+        return None
+    dt_str = text[-16:]
+    title_part = text[:-16].strip()
+    if not title_part:
+        return None
+    try:
+        deadline = datetime.strptime(dt_str, "%d.%m.%Y %H:%M")
+    except ValueError:
+        return None
+    return title_part, deadline
+
+
+def measure(func, corpus: list, repeat: int) -> tuple:
+    best = float("inf")
+    found = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        found = sum(1 for text in corpus if func(text) is not None)
+        best = min(best, time.perf_counter() - started)
+    return best / len(corpus) * 1e9, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.messages)
+    print(f"Сообщений: {len(corpus)}, лучший из {args.repeat} прогонов")
+    variants = (
+        ("strptime (было)", old_parse),
+        ("parse_task_line strict", functools.partial(parse_task_line, strict=True)),
+        ("parse_task_line", parse_task_line),
+    )
+    for name, func in variants:
+        ns, found = measure(func, corpus, args.repeat)
+        print(f"  {name:<23} {ns:8.0f} нс/сообщение, задач распознано: {found}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# bench/bench_read_model.py
+"""
+Память и скорость модели чтения активных задач (app/read_model.py).
+
+Во временный bot.db пишем N активных задач (по 10 на чат, у трети — отметки),
+затем меряем:
+- время db.load_read_model() и сколько байт занимает одна задача в модели
+  (tracemalloc, вместе с ключом сортировки и кортежем отметок);
+- для сравнения — сколько занимает та же задача строкой-dict из _dict_factory;
+- страницу «📋 Мои задачи»: ACTIVE.page против db.get_tasks_page.
+
+Запуск из корня проекта:
+    python -m bench.bench_read_model [--tasks 100000] [--pages 20000]
+"""
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+
+def _fill(n_tasks: int, seed: int):
+    from app import db
+
+    rnd = random.Random(seed)
+    now = datetime.now(db.MOSCOW_TZ).replace(tzinfo=None, second=0, microsecond=0)
+    created = datetime.utcnow().isoformat()
+    chats = max(1, n_tasks // 10)
+
+    def tasks():
+        for i in range(n_tasks):
+            deadline = now + timedelta(minutes=rnd.randint(60, 60 * 24 * 60))
+            yield (
+                -1000000000 - i % chats,
+                1000 + rnd.randrange(1000),
+                f"Подготовить отчёт по проекту {i}",
+                deadline.isoformat(),
+                db.deadline_to_epoch(deadline),
+                created,
+            )
+
+    with db._transaction() as conn:
+        conn.executemany(
+            """
+            INSERT INTO tasks (chat_id, creator_id, title, deadline_ts, deadline_at, status, created_at)
+            VALUES (?, ?, ?, ?, ?, 'active', ?)
+            """,
+            tasks(),
+        )
+        conn.executemany(
+            "INSERT INTO task_completions (task_id, user_id, completed_at) VALUES (?, ?, ?)",
+            ((task_id, 2000 + task_id % 7, created) for task_id in range(1, n_tasks + 1, 3)),
+        )
+    return [-1000000000 - i for i in range(chats)]
+
+
+def _measure(fn):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк модели чтения активных задач")
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument("--pages", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from app import db
+    from app.read_model import ACTIVE
+
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bot-read-model-bench-"), "bot.db")
+    db.init_db()
+    chats = _fill(args.tasks, args.seed)
+
+    # загрузка без tracemalloc — время, с ним — память
+    started = time.perf_counter()
+    db.load_read_model()
+    load_seconds = time.perf_counter() - started
+    ACTIVE.loaded = False
+    ACTIVE._by_id, ACTIVE._by_chat = {}, {}
+    _, _, model_bytes = _measure(db.load_read_model)
+
+    rows, _, rows_bytes = _measure(db.get_active_tasks)
+    del rows
+
+    print(f"задач: {len(ACTIVE)}, чатов: {len(chats)}")
+    print(f"загрузка модели: {load_seconds:.2f} с")
+    print(f"модель чтения:  {model_bytes / len(ACTIVE):7.0f} байт на задачу, всего {model_bytes / 2**20:.1f} МБ")
+    print(f"строки-dict:    {rows_bytes / len(ACTIVE):7.0f} байт на задачу (get_active_tasks, без отметок)")
+
+    rnd = random.Random(args.seed)
+    sample = [rnd.choice(chats) for _ in range(args.pages)]
+
+    started = time.perf_counter()
+    for chat_id in sample:
+        ACTIVE.page(chat_id, 10)
+    model_us = (time.perf_counter() - started) / len(sample) * 1e6
+
+    started = time.perf_counter()
+    for chat_id in sample:
+        db.get_tasks_page(chat_id, 10)
+    db_us = (time.perf_counter() - started) / len(sample) * 1e6
+
+    print(f"страница из 10 задач: модель {model_us:.1f} мкс, SQLite {db_us:.1f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+# bench/bench_scheduler.py
+"""
+Бенчмарк напоминаний на большой базе: 10k / 100k / 1M активных задач.
+
+Для каждого размера — отдельный процесс (чтобы пик памяти был честным):
+1) во временный bot.db пишем N активных задач по схеме до напоминаний
+   (user_version = 3) с дедлайнами в ближайшие 60 дней;
+2) init_db() — миграция заводит напоминания для всех задач (backfill);
+3) запускаем ReminderEngine и меряем время до загрузки первого окна
+   и сколько напоминаний держится в памяти;
+4) прогоняем --simulate-hours часов на виртуальных часах: event loop
+   перематывает время, когда ему нечего делать, а пока поток БД занят —
+   честно ждёт. Для каждого отправленного напоминания считаем
+   «фактическое время отправки − due_at».
+
+Отправка подменена заглушкой (сеть не меряем). Отчёт — JSON,
+его удобно сравнивать между релизами.
+
+«Сейчас» для всего прогона — BASE_TIME (понедельник 09:00 по Москве), а не
+время запуска: дедлайны, backfill напоминаний и виртуальные часы движка
+считаются от него. Иначе перенос с выходных на понедельник зависел бы
+от дня недели запуска, и число отправленных за прогон напоминаний
+между релизами было бы несравнимо.
+
+Запуск из корня проекта:
+    python -m bench.bench_scheduler [--sizes 10000,100000,1000000] [--json report.json]
+"""
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing as mp
+import os
+import queue
+import random
+import resource
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+
+from app.db import MOSCOW_TZ
+
+# понедельник: напоминания первых дней прогона не уезжают с выходных
+BASE_TIME = datetime(2025, 1, 6, 9, 0, tzinfo=MOSCOW_TZ)
+BASE_EPOCH = int(BASE_TIME.timestamp())
+
+
+def _rss_mb() -> float | None:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss_mb() -> float:
+    # в Linux ru_maxrss — в килобайтах
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+# ────────────────────────────────
+# Виртуальные часы
+# ────────────────────────────────
+class _VirtualSelector:
+    """
+    Обёртка над селектором event loop: если готовых событий нет и поток БД
+    свободен, не спим, а перематываем виртуальное время на timeout.
+    """
+
+    def __init__(self, real, loop):
+        self._real = real
+        self._loop = loop
+
+    def select(self, timeout=None):
+        events = self._real.select(0)
+        if events or timeout == 0:
+            return events
+        if self._loop.busy:
+            # ждём ответа потока БД в реальном времени, виртуальное стоит
+            return self._real.select(0.05)
+        if timeout is not None:
+            self._loop.virtual += timeout
+        return []
+
+    def __getattr__(self, name):
+        return getattr(self._real, name)
+
+
+class VirtualLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        self.virtual = 0.0
+        self.busy = 0
+        super().__init__()
+        self._selector = _VirtualSelector(self._selector, self)
+
+    def time(self) -> float:
+        return self.virtual
+
+
+# ────────────────────────────────
+# Один размер базы
+# ────────────────────────────────
+def _fill(n_tasks: int, seed: int):
+    from app import db
+
+    rnd = random.Random(seed)
+    migrations = db.MIGRATIONS
+    db.MIGRATIONS = migrations[:3]  # схема до таблицы reminders
+    try:
+        db.init_db()
+    finally:
+        db.MIGRATIONS = migrations
+
+    now = BASE_TIME.replace(tzinfo=None)
+    chats = max(1, n_tasks // 10)
+    created = datetime.utcnow().isoformat()
+
+    def rows():
+        for i in range(n_tasks):
+            deadline = now + timedelta(minutes=rnd.randint(60, 60 * 24 * 60))
+            yield (
+                -1000000000 - rnd.randrange(chats),
+                1000 + rnd.randrange(1000),
+                f"Задача {i}",
+                deadline.isoformat(),
+                db.deadline_to_epoch(deadline),
+                created,
+            )
+
+    with db._transaction() as conn:
+        conn.executemany(
+            """
+            INSERT INTO tasks (chat_id, creator_id, title, deadline_ts, deadline_at, status, created_at)
+            VALUES (?, ?, ?, ?, ?, 'active', ?)
+            """,
+            rows(),
+        )
+
+
+def _run_size(n_tasks: int, args_dict: dict, results):
+    import logging
+
+    logging.basicConfig(level=logging.WARNING)
+
+    from app import db, db_async, reminders as reminders_module
+    from app.reminders import ReminderEngine, reminder_due_times
+
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bot-sched-bench-"), "bot.db")
+    result = {"tasks": n_tasks}
+
+    started = time.perf_counter()
+    _fill(n_tasks, args_dict["seed"])
+    result["fill_seconds"] = round(time.perf_counter() - started, 3)
+
+    # backfill отбрасывает прошедшие напоминания — «прошедшие» относительно BASE_TIME
+    reminders_module.reminder_due_times = functools.partial(reminder_due_times, now=BASE_TIME)
+    started = time.perf_counter()
+    try:
+        db.init_db()
+    finally:
+        reminders_module.reminder_due_times = reminder_due_times
+    result["backfill_seconds"] = round(time.perf_counter() - started, 3)
+    result["reminders_pending"] = db._fetchone(
+        "SELECT COUNT(*) AS n FROM reminders WHERE state = 'pending'"
+    )["n"]
+    result["rss_after_backfill_mb"] = _rss_mb()
+
+    loop = VirtualLoop()
+    asyncio.set_event_loop(loop)
+    # часы движка напоминаний — виртуальные
+    reminders_module._time = types.SimpleNamespace(time=lambda: BASE_EPOCH + loop.time())
+
+    real_run = db_async.run
+
+    async def counted_run(func, *a, **kw):
+        loop.busy += 1
+        try:
+            return await real_run(func, *a, **kw)
+        finally:
+            loop.busy -= 1
+
+    db_async.run = counted_run
+
+    class FakeOutbound:
+        sent = 0
+
+        def send_message(self, chat_id, text, bot=None, **kwargs):
+            FakeOutbound.sent += 1
+            future = loop.create_future()
+            future.set_result(None)
+            return future
+
+    lags = []
+    first_window = asyncio.Event()
+
+    class BenchEngine(ReminderEngine):
+        async def _refill(self, now):
+            await super()._refill(now)
+            first_window.set()
+
+        async def _dispatch(self, batch):
+            # опоздание каждого напоминания — от его собственного due_at
+            now = BASE_EPOCH + loop.time()
+            lags.extend(now - r["due_at"] for r in batch)
+            await super()._dispatch(batch)
+
+    engine = BenchEngine(
+        None,
+        FakeOutbound(),
+        horizon=args_dict["horizon"],
+        refill_every=args_dict["refill_every"],
+        coalesce_window=args_dict["coalesce"],
+    )
+
+    async def scenario():
+        real_started = time.perf_counter()
+        engine.start()
+        await first_window.wait()
+        result["startup_seconds"] = round(time.perf_counter() - real_started, 3)
+        result["window_size"] = engine.window_size
+        result["rss_after_startup_mb"] = _rss_mb()
+
+        real_started = time.perf_counter()
+        await asyncio.sleep(args_dict["simulate_hours"] * 3600)
+        await engine.stop()
+        result["simulate_real_seconds"] = round(time.perf_counter() - real_started, 3)
+
+    loop.run_until_complete(scenario())
+    loop.run_until_complete(db_async.close())
+    loop.close()
+
+    lags.sort()
+    result.update(
+        {
+            "simulated_hours": args_dict["simulate_hours"],
+            "reminders_fired": len(lags),
+            "messages_sent": FakeOutbound.sent,
+            "lag_seconds": {
+                "p50": round(_percentile(lags, 0.50), 3),
+                "p99": round(_percentile(lags, 0.99), 3),
+                "max": round(lags[-1], 3) if lags else 0.0,
+                "early": sum(1 for lag in lags if lag < 0),  # ушли раньше срока в сводке
+            },
+            "rss_peak_mb": _peak_rss_mb(),
+        }
+    )
+    results.put(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк напоминаний на большой базе")
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--simulate-hours", type=float, default=72)
+    parser.add_argument("--horizon", type=int, default=6 * 3600)
+    parser.add_argument("--refill-every", type=int, default=300)
+    parser.add_argument("--coalesce", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="куда сохранить отчёт")
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "params": {
+            "base_time": BASE_TIME.isoformat(),
+            "simulate_hours": args.simulate_hours,
+            "horizon": args.horizon,
+            "refill_every": args.refill_every,
+            "coalesce": args.coalesce,
+        },
+        "sizes": [],
+    }
+    for size in (int(s) for s in args.sizes.split(",")):
+        results = ctx.Queue()
+        proc = ctx.Process(target=_run_size, args=(size, vars(args), results))
+        proc.start()
+        while True:
+            try:
+                result = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not proc.is_alive():
+                    raise SystemExit(f"Прогон на {size} задач упал (код {proc.exitcode})")
+        proc.join()
+        print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+        report["sizes"].append(result)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+# bench/load_test.py
+"""
+Нагрузочный тест бота целиком: диспетчер из app.main.create_dispatcher
+(хэндлеры register_handlers, очередь апдейтов, FSM в SQLite, очередь исходящих)
+против локальной заглушки Bot API вместо настоящего Telegram.
+
+Заглушка — отдельный процесс на aiohttp (sendMessage, editMessageText,
+getChat, answerCallbackQuery, setWebhook и т.д.). БД — временный файл.
+
+Сценарий по каждому из --chats групповых чатов:
+  1) --tasks-per-chat строк «Название <дата> <время>» и «📋 Мои задачи»;
+  2) «Выполнено» (done:) и «Закрыть» (close:) на задачах, /undo и снова список.
+Апдейты разных чатов перемешаны, как в живом потоке.
+
+Отчёт: апдейтов в секунду, задержка от постановки в очередь до конца
+обработки (p50/p99/max), суммарное время в БД и самые дорогие функции БД,
+число вызовов Bot API. --json сохраняет отчёт для сравнения между релизами.
+
+Запуск из корня проекта:
+    python -m bench.load_test [--chats 2000] [--tasks-per-chat 3] [--rate 200] [--json report.json]
+
+Без --rate апдейты подаются так быстро, как их принимает очередь: это замер
+пропускной способности, а задержка тогда в основном — ожидание в очереди.
+С --rate нагрузка открытая, и p50/p99 показывают задержку при этом темпе.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing as mp
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_TOKEN = "123456:load-test"
+
+
+# ────────────────────────────────
+# Заглушка Bot API
+# ────────────────────────────────
+def _stub_main(port: int, latency: float):
+    from aiohttp import web
+
+    message_ids = itertools.count(1)
+    calls: dict = {}
+
+    def message(chat_id, text):
+        chat_id = int(chat_id)
+        return {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private", "title": "bench"},
+            "text": text,
+        }
+
+    async def handle(request: web.Request):
+        method = request.match_info["method"]
+        calls[method] = calls.get(method, 0) + 1
+        data = await request.post()
+        if latency:
+            await asyncio.sleep(latency)
+
+        if method in ("sendMessage", "editMessageText"):
+            result = message(data.get("chat_id", 1), data.get("text", ""))
+        elif method == "getChat":
+            user_id = int(data["chat_id"])
+            result = {"id": user_id, "type": "private", "first_name": f"User{user_id}", "username": f"u{user_id}"}
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def stats(request: web.Request):
+        return web.json_response(calls)
+
+    app = web.Application()
+    app.router.add_get("/stats", stats)
+    app.router.add_post("/bot{token}/{method}", handle)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_port(port: int, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise SystemExit("Заглушка Bot API не поднялась")
+
+
+# ────────────────────────────────
+# Синтетические апдейты
+# ────────────────────────────────
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"u{user_id}"}
+
+
+def text_update(chat_id: int, user_id: int, text: str) -> dict:
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "group", "title": "bench"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def callback_update(chat_id: int, user_id: int, data: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_message_ids)),
+            "chat_instance": str(chat_id),
+            "from": _user(user_id),
+            "message": {
+                "message_id": next(_message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "group", "title": "bench"},
+                "text": "📋 Мои задачи",
+            },
+            "data": data,
+        },
+    }
+
+
+def _interleave(per_chat: list, rnd: random.Random) -> list:
+    """
+    Перемешать потоки чатов, сохранив порядок внутри каждого чата.
+    """
+    streams = [list(reversed(items)) for items in per_chat if items]
+    result = []
+    while streams:
+        i = rnd.randrange(len(streams))
+        result.append(streams[i].pop())
+        if not streams[i]:
+            streams[i] = streams[-1]
+            streams.pop()
+    return result
+
+
+def phase_create(chat_ids: list, tasks_per_chat: int, rnd: random.Random) -> list:
+    now = datetime.now()
+    per_chat = []
+    for chat_id in chat_ids:
+        users = [abs(chat_id) * 10 + i for i in range(3)]
+        items = []
+        for n in range(tasks_per_chat):
+            deadline = now + timedelta(days=rnd.randint(1, 60), hours=rnd.randint(0, 23))
+            items.append(
+                text_update(chat_id, rnd.choice(users), f"Задача {n} {deadline:%d.%m.%Y %H:%M}")
+            )
+        items.append(text_update(chat_id, users[0], "📋 Мои задачи"))
+        per_chat.append(items)
+    return _interleave(per_chat, rnd)
+
+
+def phase_close(tasks_by_chat: dict, rnd: random.Random) -> list:
+    per_chat = []
+    for chat_id, task_ids in tasks_by_chat.items():
+        users = [abs(chat_id) * 10 + i for i in range(3)]
+        items = []
+        if task_ids:
+            items.append(callback_update(chat_id, users[1], f"done:{task_ids[0]}"))
+            items.append(callback_update(chat_id, users[2], f"close:{task_ids[-1]}"))
+        items.append(text_update(chat_id, users[2], "/undo"))
+        items.append(text_update(chat_id, users[0], "📋 Мои задачи"))
+        per_chat.append(items)
+    return _interleave(per_chat, rnd)
+
+
+# ────────────────────────────────
+# Прогон
+# ────────────────────────────────
+def _percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _db_seconds() -> dict:
+    from app import metrics
+
+    return {values[0]: child.sum for values, child in metrics.DB_SECONDS.items()}
+
+
+async def _run_phase(name: str, dp, updates: list, rate: float = 0) -> dict:
+    from aiogram import types
+
+    from app.ingest import update_chat_id
+
+    ingest = dp["ingest"]
+    latencies = []
+    enqueued = {}
+    original = dp.process_update
+
+    async def timed(update):
+        try:
+            return await original(update)
+        finally:
+            latencies.append(time.perf_counter() - enqueued.pop(update.update_id))
+
+    dp.process_update = timed
+    db_before = _db_seconds()
+    started = time.perf_counter()
+    for i, data in enumerate(updates):
+        if rate:
+            # открытая нагрузка: апдейты приходят с заданной частотой, как от Telegram
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        update = types.Update(**data)
+        enqueued[update.update_id] = time.perf_counter()
+        await ingest.put(update_chat_id(data), update)
+    while ingest.depth or ingest.stats()["in_flight"]:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    dp.process_update = original
+
+    db_after = _db_seconds()
+    db_by_function = {
+        function: db_after[function] - db_before.get(function, 0.0) for function in db_after
+    }
+    top_db = sorted(db_by_function.items(), key=lambda item: item[1], reverse=True)[:5]
+    latencies.sort()
+    return {
+        "phase": name,
+        "updates": len(updates),
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(updates) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50) * 1000, 2),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "db_seconds": round(sum(db_by_function.values()), 3),
+        "db_top": {function: round(seconds, 3) for function, seconds in top_db if seconds > 0},
+        "errors": ingest.stats()["errors"],
+    }
+
+
+async def _bench(args, api_url: str) -> dict:
+    from aiogram import Bot, Dispatcher
+    from aiohttp import ClientSession
+
+    from app import db
+    from app.main import create_dispatcher, on_shutdown, on_startup
+
+    dp = create_dispatcher()
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    if not args.telegram_limits:
+        # меряем бота, а не лимиты Telegram на чат
+        outbound = dp["outbound"]
+        outbound.group_rate = outbound.group_capacity = outbound.private_rate = 1e6
+    await on_startup(dp)
+
+    rnd = random.Random(args.seed)
+    chat_ids = [-1000000000 - i for i in range(args.chats)]
+    phases = [
+        await _run_phase("create", dp, phase_create(chat_ids, args.tasks_per_chat, rnd), args.rate)
+    ]
+
+    tasks_by_chat: dict = {chat_id: [] for chat_id in chat_ids}
+    for task in db.get_active_tasks():
+        if task["chat_id"] in tasks_by_chat:
+            tasks_by_chat[task["chat_id"]].append(task["id"])
+    phases.append(await _run_phase("close_undo", dp, phase_close(tasks_by_chat, rnd), args.rate))
+
+    await on_shutdown(dp)
+
+    async with ClientSession() as session:
+        async with session.get(f"{api_url}/stats") as response:
+            api_calls = await response.json()
+
+    total_updates = sum(p["updates"] for p in phases)
+    total_seconds = sum(p["seconds"] for p in phases)
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "params": {
+            "chats": args.chats,
+            "tasks_per_chat": args.tasks_per_chat,
+            "concurrency": dp["ingest"].concurrency,
+            "rate": args.rate,
+            "api_latency_ms": args.api_latency_ms,
+            "telegram_limits": args.telegram_limits,
+        },
+        "total": {
+            "updates": total_updates,
+            "seconds": round(total_seconds, 3),
+            "updates_per_sec": round(total_updates / total_seconds, 1) if total_seconds else 0.0,
+        },
+        "phases": phases,
+        "api_calls": api_calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота против заглушки Bot API")
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--tasks-per-chat", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=0, help="апдейтов в секунду (0 — сколько влезет)")
+    parser.add_argument("--concurrency", type=int, default=None, help="INGEST_CONCURRENCY")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="задержка ответа заглушки")
+    parser.add_argument("--telegram-limits", action="store_true", help="оставить лимиты Telegram на чат")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="куда сохранить отчёт")
+    args = parser.parse_args()
+
+    port = _free_port()
+    stub = mp.get_context("spawn").Process(
+        target=_stub_main, args=(port, args.api_latency_ms / 1000), daemon=True
+    )
+    stub.start()
+    _wait_port(port)
+    api_url = f"http://127.0.0.1:{port}"
+
+    # окружение до импорта app.main: он читает его при импорте
+    os.environ.update(
+        BOT_TOKEN=BENCH_TOKEN,
+        WEBHOOK_URL="https://bench.invalid/webhook",
+        TELEGRAM_API_URL=api_url,
+        OUTBOUND_GLOBAL_RATE=str(10 ** 6) if not args.telegram_limits else "30",
+    )
+    if args.concurrency:
+        os.environ["INGEST_CONCURRENCY"] = str(args.concurrency)
+
+    import logging
+
+    from app import db
+
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bot-bench-"), "bot.db")
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    try:
+        report = asyncio.run(_bench(args, api_url))
+    finally:
+        stub.terminate()
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()